@@ -51,8 +51,9 @@ class TwoDMapper(ProcessDataUI, FinalDataUI):
             if self.z_device in datum:
                 self.data.append((self.last_x, self.last_y, float(datum[self.z_device][self.z_var_name])))
 
-        x_set = set(map(lambda tup: tup[0], self.data))
-        y_set = set(map(lambda tup: tup[1], self.data))
+        # The axes are sorted, as the points may not arrive in raster order (for example with a progressive traversal)
+        x_set = sorted(set(map(lambda tup: tup[0], self.data)))
+        y_set = sorted(set(map(lambda tup: tup[1], self.data)))
         parsed_dictionary: Dict[Any, Dict[Any, float | None]] = dict()
         for x in x_set:
             parsed_dictionary[x] = {}
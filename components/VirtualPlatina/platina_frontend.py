@@ -1,10 +1,9 @@
 from typing import Union, Generator, List, Dict
-from time import sleep
 
 from lantz.core import Feat
 from lantz.qt import Backend
 
-from src.SER.interfaces import ConfigurationUI, ConfigurableInstrument
+from src.SER.interfaces import ConfigurationUI, ConfigurableInstrument, SettleDeadline
 
 
 class PointSelectBackend(ConfigurableInstrument):
@@ -18,9 +17,9 @@ class PointSelectBackend(ConfigurableInstrument):
         }
 
     def configure(self, pos):
-        sleep(0.1)
-        self.log_debug("Finished configuration")
-        return {"pos": pos}
+        # The virtual motor takes 0.1 seconds to settle, the runner waits for it instead of blocking the thread
+        self.log_debug("Started configuration")
+        return SettleDeadline({"pos": pos}, 0.1)
 
     def __init__(self, **instruments_and_backends):
         super().__init__(**instruments_and_backends)
@@ -1,3 +1,6 @@
-from .instrument import Instrument, ObservableInstrument, ConfigurableInstrument
+from .instrument import Instrument, ObservableInstrument, ConfigurableInstrument, StreamingInstrument, \
+    SettleDeadline
 from .user_interface import ConfigurationUI, ProcessDataUI, FinalDataUI
 from .component import Component, ComponentInitialization
+from . import points
+from . import adaptive
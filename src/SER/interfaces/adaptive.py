@@ -0,0 +1,163 @@
+"""
+Adaptive plans choose the next points of an instrument from the observations of the previous ones, instead of
+following a fixed grid. A ConfigurableInstrument uses one by returning it from get_points (as a plain method, not a
+generator). The instrument has to be the only one in the fastest coupling level, and the points are chosen again for
+each point of the slower levels.
+"""
+from abc import abstractmethod
+from typing import Tuple, List, Dict, Any, Optional
+
+import numpy as np
+
+
+class AdaptivePlan:
+    """
+    Base class of the adaptive plans. The method propose receives the points measured so far with the value of the
+    target variable, and returns the next points to measure.
+    """
+
+    def __init__(self, target: Tuple[str, str], budget: int):
+        """
+        :param target: the component name and the variable of the observation that guides the plan.
+        :param budget: maximum amount of points of each pass of the plan.
+        """
+        self.target = target
+        self.budget = budget
+        self.history: List[Tuple[Tuple, float]] = []
+        self.queue: List[Tuple] = []
+        self.issued = 0
+        self.current: Tuple = None
+
+    def reset(self):
+        # Starts a new pass of the plan, forgetting the previous observations
+        self.history = []
+        self.queue = []
+        self.issued = 0
+        self.current = None
+
+    def next_point(self) -> Optional[Tuple]:
+        """
+        :return: the next point to measure, or None if the plan ended.
+        """
+        if self.issued >= self.budget:
+            return None
+        if not self.queue:
+            self.queue = [tuple(point) for point in self.propose(self.history)]
+            if not self.queue:
+                return None
+        self.current = self.queue.pop(0)
+        self.issued += 1
+        return self.current
+
+    def record(self, datum: Dict[str, Dict[str, Any]]):
+        """
+        Adds the data of the current point to the history.
+        """
+        value = datum.get(self.target[0], {}).get(self.target[1], float("NaN"))
+        self.history.append((self.current, float(value)))
+
+    @abstractmethod
+    def propose(self, history: List[Tuple[Tuple, float]]) -> List[Tuple]:
+        """
+        :param history: the (point, value) pairs measured in the current pass, in the order they were measured.
+        :return: the next points to measure, an empty list ends the pass.
+        """
+        raise NotImplementedError("The method propose has not been implemented")
+
+
+class Refinement1D(AdaptivePlan):
+    """
+    Measures a coarse grid and then splits the intervals with the largest change of the value, relative to the
+    ranges of the axis and the value. It concentrates the points around peaks and steep gradients, while still
+    covering the flat regions.
+    """
+
+    def __init__(self, target: Tuple[str, str], start: float, stop: float, initial: int = 10, budget: int = 100,
+                 resolution: float = 0.0):
+        """
+        :param start: first point of the axis.
+        :param stop: last point of the axis.
+        :param initial: amount of points of the initial grid.
+        :param resolution: intervals smaller than this are not split.
+        """
+        super().__init__(target, budget)
+        self.start = start
+        self.stop = stop
+        self.initial = initial
+        self.resolution = resolution
+
+    def propose(self, history: List[Tuple[Tuple, float]]) -> List[Tuple]:
+        if not history:
+            return [(x,) for x in np.linspace(self.start, self.stop, self.initial)]
+
+        points = np.array(sorted((point[0], value) for point, value in history))
+        x, y = points[:, 0], points[:, 1]
+        dx = np.diff(x)
+        dy = np.diff(np.nan_to_num(y))
+        x_range = abs(self.stop - self.start) or 1.0
+        y_range = np.ptp(np.nan_to_num(y)) or 1.0
+        # The length of each segment of the curve, with both axes normalized
+        score = np.hypot(dx / x_range, dy / y_range)
+        score[np.abs(dx) <= self.resolution * 2] = -1
+        best = int(np.argmax(score))
+        if score[best] < 0:
+            return []
+        return [((x[best] + x[best + 1]) / 2,)]
+
+
+class Refinement2D(AdaptivePlan):
+    """
+    Measures a coarse grid and then splits in four the cells with the largest change of the value between their
+    corners, weighted by their area. The points are (x, y) tuples.
+    """
+
+    def __init__(self, target: Tuple[str, str], x_range: Tuple[float, float], y_range: Tuple[float, float],
+                 initial: Tuple[int, int] = (5, 5), budget: int = 400, resolution: float = 0.0):
+        """
+        :param x_range: first and last point of the x axis.
+        :param y_range: first and last point of the y axis.
+        :param initial: amount of points of the initial grid on each axis.
+        :param resolution: cells with a side smaller than this are not split.
+        """
+        super().__init__(target, budget)
+        self.x_range = x_range
+        self.y_range = y_range
+        self.initial = initial
+        self.resolution = resolution
+        self.cells: List[Tuple[float, float, float, float]] = []
+
+    def reset(self):
+        super().reset()
+        self.cells = []
+
+    def propose(self, history: List[Tuple[Tuple, float]]) -> List[Tuple]:
+        if not history:
+            xs = np.linspace(*self.x_range, self.initial[0])
+            ys = np.linspace(*self.y_range, self.initial[1])
+            self.cells = [(x0, x1, y0, y1) for x0, x1 in zip(xs[:-1], xs[1:]) for y0, y1 in zip(ys[:-1], ys[1:])]
+            return [(x, y) for x in xs for y in ys]
+
+        values = {point: value for point, value in history}
+        value_range = np.ptp(np.nan_to_num(list(values.values()))) or 1.0
+        area = abs((self.x_range[1] - self.x_range[0]) * (self.y_range[1] - self.y_range[0])) or 1.0
+
+        best, best_score = None, -1.0
+        for cell in self.cells:
+            x0, x1, y0, y1 = cell
+            if min(abs(x1 - x0), abs(y1 - y0)) <= self.resolution * 2:
+                continue
+            corners = [values.get(corner, float("NaN")) for corner in ((x0, y0), (x0, y1), (x1, y0), (x1, y1))]
+            change = np.ptp(np.nan_to_num(corners)) / value_range
+            score = (change + 0.1) * abs((x1 - x0) * (y1 - y0)) / area
+            if score > best_score:
+                best, best_score = cell, score
+        if best is None:
+            return []
+
+        x0, x1, y0, y1 = best
+        xm, ym = (x0 + x1) / 2, (y0 + y1) / 2
+        self.cells.remove(best)
+        self.cells += [(x0, xm, y0, ym), (x0, xm, ym, y1), (xm, x1, y0, ym), (xm, x1, ym, y1)]
+        # The new corners of the four cells, some of them may be shared with cells split before
+        new_points = [(xm, ym), (x0, ym), (x1, ym), (xm, y0), (xm, y1)]
+        return [point for point in new_points if point not in values and point not in self.queue]
@@ -1,4 +1,4 @@
-from typing import Callable
+from typing import Callable, Collection
 
 from . import Instrument
 from . import ConfigurationUI
@@ -12,7 +12,8 @@ class Component:
 class ComponentInitialization:
     name: str  # The name of the component, used to distinguish the different components for the data
 
-    def __init__(self, component: Component, coupling: int, x: int, y: int, name: str = None):
+    def __init__(self, component: Component, coupling: int, x: int, y: int, name: str = None,
+                 depends_on: Collection[str] = (), insensitive_to: Collection[str] = ()):
         """
         This class provides a wrapper for the component, allowing it to have identifiable information distinct
         from the other components. This information is provided as parameters for this constructor.
@@ -23,6 +24,11 @@ class ComponentInitialization:
         :param y: The y coordinate for the configuration ui to be displayed in the configuration screen grid.
         :param name: The unique name for the component. If multiple devices with the same name are provided an exception
         will be raised.
+        :param depends_on: Names of the components whose call has to finish before this component is called in the
+        same phase (configuration or observation). Every other call is executed in parallel.
+        :param insensitive_to: Only for observable components. Names of the configurable components whose
+        configuration doesn't affect this observation. If every observer is insensitive to the components configured
+        on the next point, that configuration starts while the current point is still being observed.
         """
         self.component = component
         self.component.instrument.coupling = coupling
@@ -32,3 +38,5 @@ class ComponentInitialization:
             self.name = type(component).__name__
         else:
             self.name = name
+        self.depends_on = tuple(depends_on)
+        self.insensitive_to = frozenset(insensitive_to)
@@ -1,10 +1,28 @@
 from abc import abstractmethod
-from typing import Tuple, Dict, Any, Generator
+from time import perf_counter
+from typing import Tuple, Dict, Any, Generator, List, Union, Sequence
 
+import numpy as np
 from lantz.core.log import get_logger
 from lantz.qt import Backend
 
 
+class SettleDeadline:
+    """
+    Value that configure can return instead of blocking while the hardware settles, like a stage that was commanded
+    to move. The runner waits for the latest deadline among all the configured instruments before observing, so the
+    settle times of different instruments overlap.
+    """
+
+    def __init__(self, datum: Dict[str, Any], seconds: float):
+        """
+        :param datum: the dictionary of relevant parameters configure would have returned.
+        :param seconds: the time the instrument needs to settle, counted from now.
+        """
+        self.datum = datum
+        self.deadline = perf_counter() + seconds
+
+
 class Instrument(Backend):
     """
     Class handling one or multiple devices, their configuration between runs and providing the variable documentation
@@ -14,6 +32,25 @@ class Instrument(Backend):
         if you need to update a parameter between runs, you can overload it and utilize it
     """
 
+    # Where the Dispatcher runs the configure/observe calls of this instrument. With "thread" (the default) it gets a
+    # dedicated worker thread. With "process" the instrument is rebuilt inside a dedicated worker process from its
+    # class and get_config(), so it must be constructible without arguments, and only that copy gets initialize and
+    # finalize. Use it for CPU bound instruments.
+    execution_backend: str = "thread"
+
+    # Bytes of the ring buffer in shared memory of an instrument with the "process" backend. The arrays of 64 KiB or
+    # more it returns are written there instead of being pickled through the pipe. 0 disables it.
+    shared_memory_size: int = 16 * 2 ** 20
+
+    # Deadlines in seconds for each call to configure and observe, and to their batch versions. If a call takes longer,
+    # stop() gets called and the run ends with a TimeoutError. None waits indefinitely.
+    configure_timeout: float = None
+    observe_timeout: float = None
+
+    # Amount of points this instrument can take in a single call of configure_batch/observe_batch. When every
+    # instrument of the experiment supports batches, the runner hands them whole chunks of the scan. 0 disables it.
+    batch_size: int = 0
+
     def __init__(self, **instruments_and_backends):
         super().__init__(**instruments_and_backends)
         self.logger_name = 'SER.Instrument.' + str(self)
@@ -56,20 +93,98 @@ class Instrument(Backend):
 
 
 class ObservableInstrument(Instrument):
+    # Observations that are arrays with a fixed shape, like a spectrum or a camera frame, declared as
+    # {variable: (shape, dtype)}. They are stored in preallocated arrays instead of as Python objects. An array
+    # returned by observe without being declared is stored the same way, with the shape and dtype of the first one,
+    # until an array of another shape arrives.
+    observe_arrays: Dict[str, Tuple[Tuple[int, ...], str]] = {}
 
     @abstractmethod
     def observe(self) -> Dict[str, Any]:
         """
-        This method gets called on each iteration points of the experiment.
+        This method gets called on each iteration points of the experiment. It can also be declared as a coroutine
+        (async def), in which case it's awaited in the event loop of the dispatcher instead of using a thread.
 
         :return: a dictionary of observable parameters and their values.
         """
         raise NotImplementedError("The method observe has not been implemented")
 
+    def observe_batch(self, amount: int) -> Union[List[Dict[str, Any]], Dict[str, Sequence]]:
+        """
+        Optional. Used instead of observe when every instrument has a batch_size, to acquire a whole chunk of points
+        in one call, after the configurable instruments received the chunk with configure_batch.
+
+        :param amount: the amount of points in the chunk.
+        :return: a list with a dictionary of observable parameters for each point, or a dictionary of observable
+        parameters with a sequence (like a numpy array) of the values for each point.
+        """
+        raise NotImplementedError("The method observe_batch has not been implemented")
+
+
+class StreamingInstrument(ObservableInstrument):
+    """
+    Observable instrument that produces a continuous stream of samples, like a lock-in amplifier or a DAQ card.
+    Instead of calling observe on each point, the runner starts the stream once per run and reads it on a background
+    thread into a preallocated ring buffer. Each point receives the samples captured between the start of its
+    configuration and the end of its observation, through the method summarize. When the configuration of a point
+    overlaps the previous point, its samples start where the previous point ended.
+    """
+
+    # Amount of channels of each sample, the data type of the samples and the amount of samples kept in the ring
+    # buffer. The buffer has to be big enough to hold the samples of a whole point.
+    stream_channels: int = 1
+    stream_dtype: str = "float64"
+    stream_capacity: int = 2 ** 20
+
+    # Sampling rate in Hz. If set, each sample of a block is timed individually, otherwise every sample of a block
+    # gets the time at which the block was read.
+    stream_rate: float = None
+
+    def start_stream(self) -> None:
+        """
+        This method gets called at the start of each run, before the first read_stream.
+        """
+        return
+
+    def stop_stream(self) -> None:
+        """
+        This method gets called at the end of each run. After it, read_stream should return as soon as possible.
+        """
+        return
+
+    @abstractmethod
+    def read_stream(self) -> np.ndarray:
+        """
+        This method gets called continuously from a background thread during the run. It should block until the next
+        block of samples is available.
+
+        :return: an array of shape (samples,) or (samples, channels) with the samples in order.
+        """
+        raise NotImplementedError("The method read_stream has not been implemented")
+
+    def summarize(self, samples: np.ndarray) -> Dict[str, Any]:
+        """
+        This method gets called on each point with the samples captured during it. Override it to reduce the samples,
+        for example to their mean.
+
+        :param samples: array of shape (samples, channels).
+        :return: a dictionary of observable parameters and their values.
+        """
+        return {"samples": samples}
+
+    def observe(self) -> Dict[str, Any]:
+        return self.summarize(np.zeros((0, self.stream_channels), dtype=self.stream_dtype))
+
 
 class ConfigurableInstrument(Instrument):
     coupling: int = 0
 
+    # Order in which the points of the coupling level of the instrument are visited. "raster" restarts from the first
+    # point on each pass, "serpentine" alternates the direction of each pass so a motion axis doesn't fly back, and
+    # "nearest" visits an explicit list of numeric points in a nearest neighbour path. The data of each point is
+    # tagged with its logical index in raster order, as run.point.
+    traversal: str = "raster"
+
     def set_coupling(self, value):
         """
         Sets the coupling to the given value
@@ -99,28 +214,57 @@ class ConfigurableInstrument(Instrument):
     def configure(self, *args) -> Dict[str, Any]:
         """
         This method gets called on each iteration points of the experiment. It receives an unrolled tuple,
-        so you can replace *args with your arguments.
+        so you can replace *args with your arguments. It can also be declared as a coroutine (async def), in which
+        case it's awaited in the event loop of the dispatcher instead of using a thread.
+
+        If the hardware needs time to settle after being commanded, return a SettleDeadline with the dictionary and
+        the settle time instead of sleeping.
         
         :return: a dictionary of relevant parameters and their values.
         """
         raise NotImplementedError("The method configure has not been implemented")
 
-    @abstractmethod
+    def configure_batch(self, points: List[Tuple]) -> List[Dict[str, Any]]:
+        """
+        Optional. Used instead of configure when every instrument has a batch_size, to load a whole chunk of the scan
+        in one call, for example the setpoints of a hardware timed sweep.
+
+        If the hardware needs time to settle, return a SettleDeadline with the list, or a SettleDeadline for each
+        point. The chunk is observed after the latest deadline.
+
+        :param points: the arguments configure would receive on each point of the chunk.
+        :return: a list with a dictionary of relevant parameters for each point.
+        """
+        raise NotImplementedError("The method configure_batch has not been implemented")
+
+    def get_plan(self) -> np.ndarray:
+        """
+        Optional. Provides every point of the instrument at once as a structured NumPy array, with a field for each
+        argument of configure, instead of writing a generator in get_points. The primitives of the module
+        SER.interfaces.points (linspace, logspace, point_list, spiral, grid, random_subset) build these arrays.
+        When implemented, get_points and point_amount are not needed, and counting or previewing the scan is
+        immediate.
+
+        :return: a structured array with a row for each point.
+        """
+        raise NotImplementedError("The method get_plan has not been implemented")
+
     def get_points(self) -> Generator[Tuple, None, None]:
         """
         The function get_points is tasked with providing the points a component will use during its execution.
         The way it does this is through python Generators, as the task reads the task point by point. You can also
-        provide other iterators that support next(_) and StopIteration.
+        provide other iterators that support next(_) and StopIteration. Asynchronous generators (async def with
+        yield) and coroutines returning an iterable are also supported.
 
         If 2 components are coupled AKA they both move simultaneously, they need to yield the same amount of points.
-        Not respecting this is undefined behaviour
+        Not respecting this is undefined behaviour. It has to be implemented unless the instrument implements get_plan.
         :return: Generator with the amount of desired points
         """
-        yield
+        for point in self.get_plan():
+            yield point.item()
 
-    @abstractmethod
     def point_amount(self) -> int:
         """
         :return: the amount of points this instrument generates with the Generator from get_points
         """
-        return 0
+        return len(self.get_plan())
@@ -0,0 +1,84 @@
+"""
+Primitives to build the points of a ConfigurableInstrument as a structured NumPy array, which can be returned by
+get_plan instead of writing a generator in get_points. Each field of the array is an argument of configure, in order.
+"""
+from typing import Sequence, Tuple, Union
+
+import numpy as np
+
+
+def fields_dtype(fields: Sequence[str], dtype="float64") -> np.dtype:
+    return np.dtype([(field, dtype) for field in fields])
+
+
+def linspace(start: float, stop: float, num: int, field: str = "pos") -> np.ndarray:
+    """
+    :return: num points evenly spaced from start to stop, both included.
+    """
+    plan = np.empty(num, dtype=fields_dtype([field]))
+    plan[field] = np.linspace(start, stop, num)
+    return plan
+
+
+def logspace(start: float, stop: float, num: int, field: str = "pos") -> np.ndarray:
+    """
+    :return: num points from start to stop, both included, evenly spaced in a logarithmic scale. Unlike
+    numpy.logspace, start and stop are the values and not their exponents.
+    """
+    plan = np.empty(num, dtype=fields_dtype([field]))
+    plan[field] = np.geomspace(start, stop, num)
+    return plan
+
+
+def point_list(values: Sequence[Union[float, Tuple]], fields: Sequence[str] = ("pos",), dtype="float64") \
+        -> np.ndarray:
+    """
+    :param values: the explicit points, as scalars for a single field or tuples with a value for each field.
+    :return: the given points as a plan.
+    """
+    values = np.asarray(values, dtype=dtype).reshape(len(values), len(fields))
+    plan = np.empty(len(values), dtype=fields_dtype(fields, dtype))
+    for i, field in enumerate(fields):
+        plan[field] = values[:, i]
+    return plan
+
+
+def spiral(center: Tuple[float, float], radius: float, turns: float, num: int,
+           fields: Tuple[str, str] = ("x", "y")) -> np.ndarray:
+    """
+    :return: num points over an archimedean spiral that starts at the center and ends at the radius after the given
+    amount of turns. The points are spaced with approximately the same distance along the spiral.
+    """
+    # The length along the spiral grows with the square of the angle, so a square root spaces the points evenly
+    theta = np.sqrt(np.linspace(0, 1, num)) * 2 * np.pi * turns
+    r = radius * theta / (2 * np.pi * turns) if turns else np.zeros(num)
+    plan = np.empty(num, dtype=fields_dtype(fields))
+    plan[fields[0]] = center[0] + r * np.cos(theta)
+    plan[fields[1]] = center[1] + r * np.sin(theta)
+    return plan
+
+
+def grid(*plans: np.ndarray) -> np.ndarray:
+    """
+    Combines the plans of several arguments of a single instrument into every combination of their points. The last
+    plan is the one that changes on every point.
+
+    :return: a plan with the fields of every plan.
+    """
+    indices = np.meshgrid(*[np.arange(len(plan)) for plan in plans], indexing="ij")
+    dtype = np.dtype([field for plan in plans for field in plan.dtype.descr])
+    result = np.empty(indices[0].size if indices else 0, dtype=dtype)
+    for plan, index in zip(plans, indices):
+        for field in plan.dtype.names:
+            result[field] = plan[field][index.ravel()]
+    return result
+
+
+def random_subset(plan: np.ndarray, amount: int, seed: int = None) -> np.ndarray:
+    """
+    :return: amount points of the plan chosen at random without repetition, in the order they had in the plan.
+    """
+    if amount > len(plan):
+        raise Exception(f"Can't choose {amount} points from a plan of {len(plan)} points")
+    chosen = np.random.default_rng(seed).choice(len(plan), amount, replace=False)
+    return plan[np.sort(chosen)]
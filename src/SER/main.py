@@ -4,6 +4,9 @@ from typing import Collection, Any
 from PyQt5.QtWidgets import QApplication, QWidget
 
 from .model import ExperimentSequencer
+from .model.checkpoint import Checkpointer
+from .model.criteria import StopCriterion
+from .model.writer import DataWriter
 from .ui import MainWidget, localizator
 from .interfaces import ComponentInitialization, ProcessDataUI, FinalDataUI
 from .log import log_to_socket, LOGGER, log_to_screen
@@ -20,6 +23,15 @@ def get_main_widget(
         conf_folder=".",
         out_folder=".",
         locale="en",
+        checkpoint_file: str = None,
+        checkpoint_interval: float = 60.0,
+        stop_criteria: Collection[StopCriterion] = (),
+        data_file: str = None,
+        data_file_interval: float = 1.0,
+        memory_budget: float = None,
+        spill_folder: str = None,
+        trace_memory: bool = False,
+        arrays_on_disk: bool = False,
 ) -> QWidget:
     """
     This function creates a widget that contains the SER. The widget loads the configuration ui provided by the
@@ -34,6 +46,20 @@ def get_main_widget(
     :param conf_folder: Direction to a folder where to open the save dialog for configuration files by default
     :param out_folder: Direction to a folder where to open the save dialog for output files by default
     :param locale: Value indicating what language to display the interface. 'en' for english and 'es' for spanish
+    :param checkpoint_file: Path of a file where to periodically save the progress of the sequence, so it can be
+    resumed if it gets interrupted. If None, no checkpoints are saved.
+    :param checkpoint_interval: Minimum amount of seconds between checkpoints
+    :param stop_criteria: List of StopCriterion (from SER.model.criteria) evaluated after each point. When one is met,
+    the run ends and the sequence moves on to the next run
+    :param data_file: Path of a file where the points are appended during the sequence, so the data survives a crash.
+    Files ending in .arrow or .arrows are written as Arrow IPC streams if pyarrow is installed, others as JSON lines.
+    :param data_file_interval: Seconds between the writes to the data file
+    :param memory_budget: Maximum amount of MiB of data kept in memory. Once it's exceeded, the oldest points are
+    spilled to disk and read back when needed. If None, every point is kept in memory
+    :param spill_folder: Folder where the spilled points are written, a temporary folder if None
+    :param trace_memory: If True, the memory of each run is traced with tracemalloc and logged at the end
+    :param arrays_on_disk: If True, the array observations, like spectra or frames, are stored in memory mapped files
+    in spill_folder instead of in memory
     :return: A QWidget that can be embedded in your QT application.
     """
     # TODO: Parametrize logging
@@ -41,7 +67,11 @@ def get_main_widget(
     localizator.set(locale)
 
     # The main interface that has the code to start the experiment
-    sequencer = ExperimentSequencer(configurable_components, observable_components)
+    checkpointer = Checkpointer(checkpoint_file, checkpoint_interval) if checkpoint_file else None
+    writer = DataWriter(data_file, data_file_interval) if data_file else None
+    budget = None if memory_budget is None else int(memory_budget * 2 ** 20)
+    sequencer = ExperimentSequencer(configurable_components, observable_components, checkpointer, stop_criteria,
+                                    writer, budget, spill_folder, trace_memory, arrays_on_disk)
     window = MainWidget([*configurable_components, *observable_components],
                         run_data_ui, final_data_ui, sequencer, coupling_ui_options, conf_folder, out_folder)
 
@@ -59,7 +89,16 @@ def launch_app(
         coupling_ui_options: dict[str, Any] = {},
         conf_folder=".",
         out_folder=".",
-        locale="en"
+        locale="en",
+        checkpoint_file: str = None,
+        checkpoint_interval: float = 60.0,
+        stop_criteria: Collection[StopCriterion] = (),
+        data_file: str = None,
+        data_file_interval: float = 1.0,
+        memory_budget: float = None,
+        spill_folder: str = None,
+        trace_memory: bool = False,
+        arrays_on_disk: bool = False,
 ):
     """
     This function uses the widget created by get_main_widget(...) to create the main QT application.
@@ -75,10 +114,26 @@ def launch_app(
     :param conf_folder: Direction to a folder where to open the save dialog for configuration files by default
     :param out_folder: Direction to a folder where to open the save dialog for output files by default
     :param locale: Value indicating what language to display the interface. 'en' for english and 'es' for spanish
+    :param checkpoint_file: Path of a file where to periodically save the progress of the sequence, so it can be
+    resumed if it gets interrupted. If None, no checkpoints are saved.
+    :param checkpoint_interval: Minimum amount of seconds between checkpoints
+    :param stop_criteria: List of StopCriterion (from SER.model.criteria) evaluated after each point. When one is met,
+    the run ends and the sequence moves on to the next run
+    :param data_file: Path of a file where the points are appended during the sequence, so the data survives a crash.
+    Files ending in .arrow or .arrows are written as Arrow IPC streams if pyarrow is installed, others as JSON lines.
+    :param data_file_interval: Seconds between the writes to the data file
+    :param memory_budget: Maximum amount of MiB of data kept in memory. Once it's exceeded, the oldest points are
+    spilled to disk and read back when needed. If None, every point is kept in memory
+    :param spill_folder: Folder where the spilled points are written, a temporary folder if None
+    :param trace_memory: If True, the memory of each run is traced with tracemalloc and logged at the end
+    :param arrays_on_disk: If True, the array observations, like spectra or frames, are stored in memory mapped files
+    in spill_folder instead of in memory
     :return: None. This will return when the user closes the app.
     """
     window = get_main_widget(configurable_components, observable_components, run_data_ui, final_data_ui,
-                             coupling_ui_options, conf_folder, out_folder, locale)
+                             coupling_ui_options, conf_folder, out_folder, locale, checkpoint_file,
+                             checkpoint_interval, stop_criteria, data_file, data_file_interval, memory_budget,
+                             spill_folder, trace_memory, arrays_on_disk)
     window.setWindowTitle(localizator.get("SER"))
     window.show()
     app.exec()
@@ -0,0 +1,78 @@
+import pickle
+from os import replace, path
+from threading import Thread
+from time import monotonic
+from typing import Dict, Any
+
+from lantz.core.log import get_logger
+from pimpmyclass.mixins import LogMixin
+
+
+class Checkpointer(LogMixin):
+    """
+    Periodically saves the position of the sequence (run index and point of the run) together with the contents
+    of the DataRepository, so an interrupted sequence can be resumed from the next unmeasured point.
+
+    The checkpoint is written to a temporary file that then replaces the previous one, so a crash while saving
+    never leaves a corrupted checkpoint behind. The periodic checkpoints are pickled and written on a background
+    thread (see save_in_background), so the run only waits for the copy of the state.
+    """
+
+    def __init__(self, filename: str, interval: float = 60.0):
+        """
+        :param filename: path of the checkpoint file.
+        :param interval: minimum amount of seconds between checkpoints.
+        """
+        self.logger = get_logger("SER.Core.Checkpointer")
+        self.filename = filename
+        self.interval = interval
+        self.last_save = monotonic()
+        self.thread: Thread = None  # The background save in progress, if any
+
+    def due(self) -> bool:
+        return monotonic() - self.last_save >= self.interval
+
+    def save_in_background(self, state: Dict[str, Any]):
+        """
+        Saves the state on a background thread. The state must not change afterwards, DataRepository.state returns
+        copies. If the previous background save is still writing, this checkpoint is skipped.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.last_save = monotonic()
+        self.thread = Thread(target=self.save_logged, args=(state,), name="SER-Checkpoint", daemon=True)
+        self.thread.start()
+
+    def save_logged(self, state: Dict[str, Any]):
+        try:
+            self.save(state)
+        except Exception as e:
+            self.log_error(f"Could not save the checkpoint: {e}")
+
+    def wait(self):
+        """
+        Waits for the background save in progress, if any. Call it before save, so an older state doesn't replace
+        the checkpoint afterwards.
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def save(self, state: Dict[str, Any]):
+        temporary = self.filename + ".tmp"
+        with open(temporary, "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(temporary, self.filename)
+        self.last_save = monotonic()
+        self.log_debug(f"Saved checkpoint at run {state['run']}, point {state['position']}")
+
+    @staticmethod
+    def load(filename: str) -> Dict[str, Any]:
+        """
+        :return: the state saved in the checkpoint, a dictionary with the keys "sequence", "run", "position",
+        "complete" and "data".
+        """
+        if not path.exists(filename):
+            raise Exception(f"There is no checkpoint in {filename}")
+        with open(filename, "rb") as file:
+            return pickle.load(file)
@@ -0,0 +1,149 @@
+from abc import abstractmethod
+from time import monotonic
+from typing import Tuple, Dict, Any, Optional
+
+import numpy as np
+
+
+class StopCriterion:
+    """
+    Condition evaluated by the ExperimentRunner after each point. When it's met, the run ends and the sequence moves
+    on to the next run, or ends if the criterion has ends_sequence.
+    """
+
+    # If True, the sequence ends instead of moving on to the next run
+    ends_sequence: bool = False
+
+    def start_sequence(self):
+        pass
+
+    def start_run(self):
+        pass
+
+    @abstractmethod
+    def check(self, datum: Dict[str, Dict[str, Any]]) -> bool:
+        """
+        :param datum: the data of the point that just finished, as stored in the DataRepository.
+        :return: if the run has to end.
+        """
+        raise NotImplementedError("The method check has not been implemented")
+
+    def reason(self) -> str:
+        return type(self).__name__
+
+
+def target_value(datum: Dict[str, Dict[str, Any]], target: Tuple[str, str]) -> Optional[float]:
+    # The value of the variable of the component, or None if the point doesn't have it
+    value = datum.get(target[0], {}).get(target[1])
+    return None if value is None else float(value)
+
+
+class Threshold(StopCriterion):
+    """
+    Ends the run when an observed variable goes above or below a value.
+    """
+
+    def __init__(self, target: Tuple[str, str], above: float = None, below: float = None):
+        """
+        :param target: the component name and the variable to check.
+        :param above: the run ends when the value is greater than this.
+        :param below: the run ends when the value is lower than this.
+        """
+        if above is None and below is None:
+            raise Exception("The threshold needs a value for above or below")
+        self.target = target
+        self.above = above
+        self.below = below
+        self.value = None
+
+    def check(self, datum: Dict[str, Dict[str, Any]]) -> bool:
+        self.value = target_value(datum, self.target)
+        if self.value is None:
+            return False
+        return (self.above is not None and self.value > self.above) or \
+            (self.below is not None and self.value < self.below)
+
+    def reason(self) -> str:
+        return f"{self.target[0]} {self.target[1]} reached {self.value}"
+
+
+class Convergence(StopCriterion):
+    """
+    Ends the run when the running mean of an observed variable changed less than epsilon over the last window
+    points.
+    """
+
+    def __init__(self, target: Tuple[str, str], epsilon: float, window: int = 10):
+        """
+        :param target: the component name and the variable to check.
+        :param epsilon: maximum change of the running mean to consider it converged.
+        :param window: amount of points over which the change is measured.
+        """
+        self.target = target
+        self.epsilon = epsilon
+        self.window = window
+        self.means = np.zeros(window + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def start_run(self):
+        self.total = 0.0
+        self.count = 0
+
+    def check(self, datum: Dict[str, Dict[str, Any]]) -> bool:
+        value = target_value(datum, self.target)
+        if value is None:
+            return False
+        self.total += value
+        self.count += 1
+        # The running means of the last window + 1 points are kept in a circular buffer
+        self.means[self.count % len(self.means)] = self.total / self.count
+        if self.count <= self.window:
+            return False
+        return abs(self.means[self.count % len(self.means)] - self.means[(self.count + 1) % len(self.means)]) \
+            <= self.epsilon
+
+    def reason(self) -> str:
+        return f"the mean of {self.target[0]} {self.target[1]} converged to {self.total / max(self.count, 1)}"
+
+
+class Budget(StopCriterion):
+    """
+    Ends the run after an amount of time or points. With sequence=True, the budget is for the whole sequence and
+    the sequence ends when it's spent.
+    """
+
+    def __init__(self, minutes: float = None, points: int = None, sequence: bool = False):
+        """
+        :param minutes: maximum duration.
+        :param points: maximum amount of points.
+        :param sequence: if the budget is for the whole sequence instead of each run.
+        """
+        if minutes is None and points is None:
+            raise Exception("The budget needs an amount of minutes or points")
+        self.minutes = minutes
+        self.points = points
+        self.ends_sequence = sequence
+        self.start = monotonic()
+        self.count = 0
+
+    def reset(self):
+        self.start = monotonic()
+        self.count = 0
+
+    def start_sequence(self):
+        self.reset()
+
+    def start_run(self):
+        if not self.ends_sequence:
+            self.reset()
+
+    def check(self, datum: Dict[str, Dict[str, Any]]) -> bool:
+        self.count += 1
+        return (self.points is not None and self.count >= self.points) or \
+            (self.minutes is not None and monotonic() - self.start >= self.minutes * 60)
+
+    def reason(self) -> str:
+        if self.points is not None and self.count >= self.points:
+            return f"the budget of {self.points} points was spent"
+        return f"the budget of {self.minutes} minutes was spent"
@@ -1,90 +1,973 @@
-from typing import List, Dict, Tuple, Any
+import sys
+import tracemalloc
+from datetime import datetime
+from os import path, makedirs, close, remove
+from tempfile import mkdtemp, mkstemp
+from threading import Lock
+from typing import List, Dict, Tuple, Any, Callable, Union, Set
 
+import numpy as np
 from lantz.core.log import get_logger
 from pimpmyclass.mixins import LogMixin
 from scipy.io import savemat
 import pandas as pd
 
+from .transport import SharedArray
+
+INITIAL_CAPACITY = 1024
+# The int columns of this component are times in nanoseconds since the epoch, which are exported as datetimes
+TIME_COMPONENT = "timestamp"
+ARRAY_BLOCK_BYTES = 64 * 2 ** 20  # Maximum size of each block of an ArrayColumn
+SPILL_MINIMUM = 256  # Minimum amount of points written to disk at once, so a tight budget doesn't write every point
+NO_ROW = 2 ** 62
+
+# The kinds of values a column can hold and the dtype used to store them. A column starts with the kind of its first
+# value, and it's promoted when a value of a different kind arrives (int to float, anything else to object).
+KIND_DTYPES = {
+    "bool": np.dtype("bool"),
+    "int": np.dtype("int64"),
+    "float": np.dtype("float64"),
+    "datetime": np.dtype("datetime64[us]"),
+    "object": np.dtype("object"),
+}
+
+
+# Fast path of value_kind for the most common types
+TYPE_KINDS = {bool: "bool", int: "int", float: "float", datetime: "datetime"}
+
+
+def value_kind(value: Any) -> str:
+    kind = TYPE_KINDS.get(type(value))
+    if kind is not None:
+        return kind
+    if isinstance(value, (bool, np.bool_)):
+        return "bool"
+    if isinstance(value, (int, np.integer)):
+        return "int"
+    if isinstance(value, (float, np.floating)):
+        return "float"
+    if isinstance(value, datetime):
+        return "datetime"
+    return "object"
+
+
+def common_kind(kind: str, other: str) -> str:
+    if kind == other:
+        return kind
+    if {kind, other} == {"int", "float"}:
+        return "float"
+    return "object"
+
+
+def missing_values(kind: str, size: int) -> np.ndarray:
+    # The filled values of a column on rows before it existed
+    if kind == "datetime":
+        return np.full(size, np.datetime64("NaT"), dtype=KIND_DTYPES[kind])
+    return np.full(size, float("NaN"), dtype="object" if kind in ("bool", "object") else "float64")
+
+
+def missing_arrays(shape: Tuple[int, ...], dtype: np.dtype, size: int) -> np.ndarray:
+    # The arrays of the points that don't have one, NaN if the dtype can hold it
+    values = np.zeros((size,) + tuple(shape), dtype=dtype)
+    if values.dtype.kind in "fc":
+        values[:] = float("NaN")
+    return values
+
+
+def array_views(values: np.ndarray, present: np.ndarray) -> np.ndarray:
+    # An object array with a view of the array of each point, or NaN if the point doesn't have one
+    views = np.full(len(present), float("NaN"), dtype=object)
+    for row in np.flatnonzero(present):
+        views[row] = values[row]
+    return views
+
+
+def time_values(values: np.ndarray, present: np.ndarray) -> np.ndarray:
+    # The times aren't forward filled, a point without the time of an instrument didn't call it
+    times = np.asarray(values, dtype=np.int64).view("datetime64[ns]").copy()
+    times[~np.asarray(present)] = np.datetime64("NaT")
+    return times
+
+
+def object_size(value: Any) -> int:
+    # The size of an ndarray includes its buffer when it owns it
+    return sys.getsizeof(value)
+
+
+def capacity_for(size: int) -> int:
+    return max(INITIAL_CAPACITY, 2 ** int(np.ceil(np.log2(max(size + 1, 1)))))
+
+
+class Chunk:
+    """
+    Consecutive points spilled to disk by the DataRepository. Each array is a .npy file in the directory of the chunk,
+    the numeric ones are memory mapped when read.
+    """
+
+    def __init__(self, directory: str, start: int, stop: int, kinds: Dict[Tuple[str, str], str]):
+        self.directory = directory
+        self.start = start
+        self.stop = stop
+        self.kinds = kinds
+        self.keys = {key: i for i, key in enumerate(kinds)}
+        self.bytes = 0
+
+    def file(self, name: str) -> str:
+        return path.join(self.directory, f"{name}.npy")
+
+    def save(self, name: str, array: np.ndarray):
+        np.save(self.file(name), array, allow_pickle=True)
+        self.bytes += path.getsize(self.file(name))
+
+    def load(self, name: str) -> np.ndarray:
+        try:
+            return np.load(self.file(name), mmap_mode="r")
+        except ValueError:
+            # Object arrays are pickled, so they can't be memory mapped
+            return np.load(self.file(name), allow_pickle=True)
+
+    def column(self, key: Tuple[str, str], part: str) -> np.ndarray:
+        return self.load(f"{self.keys[key]}.{part}")
+
+    def filled(self, key: Tuple[str, str], kind: str) -> np.ndarray:
+        if key not in self.keys:
+            return missing_values(kind, self.stop - self.start)
+        if self.kinds[key] == "array":
+            return array_views(self.column(key, "values"), self.column(key, "present"))
+        return self.column(key, "filled")
+
+
+class Column:
+    """
+    Growable typed array with the values of a variable of a component, and a presence bitmap that marks the points
+    that have a value. Configuration data is sparse, as it's only added on the points where the instrument was
+    configured.
+    """
+
+    def __init__(self, kind: str, capacity: int):
+        self.kind = kind
+        self.values = np.zeros(capacity, dtype=KIND_DTYPES[kind])
+        self.present = np.zeros(capacity, dtype=bool)
+        self.first = NO_ROW  # First row with a value
+        self.object_bytes = 0  # Estimated size of the objects referenced by an object column
+
+        # Value of the last row spilled to disk with a value, which fills the first rows still in memory
+        self.before: Any = None
+        self.has_before = False
+
+        # The forward filled values are cached and extended with the new rows. A write to a row that was already
+        # filled invalidates the cache from that row.
+        self.cache: np.ndarray = None
+        self.cached = 0  # Amount of rows of the cache that are valid
+        self.carry = -1  # Last row with a value among the cached rows, or None if it has to be searched
+
+    def grow(self, capacity: int):
+        values = np.zeros(capacity, dtype=self.values.dtype)
+        values[:len(self.values)] = self.values
+        present = np.zeros(capacity, dtype=bool)
+        present[:len(self.present)] = self.present
+        self.values, self.present = values, present
+
+    def invalidate(self, index: int):
+        if index < self.cached:
+            self.cached = index
+            self.carry = None
+
+    def set(self, index: int, value: Any):
+        kind = value_kind(value)
+        if kind != self.kind and common_kind(self.kind, kind) != self.kind:
+            self.kind = common_kind(self.kind, kind)
+            self.values = self.values.astype(KIND_DTYPES[self.kind])
+            self.invalidate(0)
+            if self.kind == "object":
+                self.object_bytes = sum(object_size(value) for value in self.values[self.present])
+        if self.kind == "object":
+            self.object_bytes += object_size(value)
+        self.values[index] = value
+        self.present[index] = True
+        self.first = min(self.first, index)
+        self.invalidate(index)
+
+    def get(self, index: int) -> Any:
+        value = self.values[index]
+        return value if self.kind == "object" else value.item()
+
+    def filled_dtype(self) -> np.dtype:
+        # The rows before the first value are missing, so they need a dtype that can hold NaN
+        if self.first == 0 or self.has_before:
+            return self.values.dtype
+        if self.kind in ("int", "float"):
+            return np.dtype("float64")
+        if self.kind == "datetime":
+            return self.values.dtype
+        return np.dtype("object")
+
+    def filled(self, size: int) -> np.ndarray:
+        """
+        :return: the values of the first size points, where each missing value is replaced by the previous present
+        one, or NaN if there is none. Only the rows added or written since the previous call are computed.
+        """
+        dtype = self.filled_dtype()
+        if self.cache is None or self.cache.dtype != dtype or len(self.cache) < size:
+            cache = np.empty(max(size, len(self.values)), dtype=dtype)
+            if self.cache is not None and self.cache.dtype == dtype:
+                cache[:self.cached] = self.cache[:self.cached]
+            else:
+                self.cached, self.carry = 0, -1
+            self.cache = cache
+
+        if self.cached < size:
+            start = self.cached
+            if self.carry is None:
+                previous = np.flatnonzero(self.present[:start])
+                self.carry = int(previous[-1]) if len(previous) else -1
+            # The index of the last present value at each row, through a running maximum
+            last = np.maximum.accumulate(np.where(self.present[start:size], np.arange(start, size), self.carry))
+            segment = self.values[np.maximum(last, 0)].astype(dtype)
+            missing = last < 0
+            if missing.any():
+                if self.has_before:
+                    segment[missing] = self.before
+                else:
+                    segment[missing] = np.datetime64("NaT") if self.kind == "datetime" else float("NaN")
+            self.cache[start:size] = segment
+            self.carry = int(last[-1])
+            self.cached = size
+        return self.cache[:size]
+
+    def nbytes(self) -> int:
+        cache = 0 if self.cache is None else self.cache.nbytes
+        return self.values.nbytes + self.present.nbytes + cache + self.object_bytes
+
+    def state(self, size: int) -> Tuple:
+        return self.kind, self.values[:size].copy(), self.present[:size].copy(), self.has_before, self.before
+
+    def spill(self, amount: int, size: int, capacity: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Removes the first amount rows, moving the following ones to the start of new arrays.
+
+        :param size: amount of rows with data.
+        :param capacity: capacity of the new arrays.
+        :return: the values, presence and filled values of the removed rows.
+        """
+        filled = self.filled(amount).copy()
+        values, present = self.values[:amount].copy(), self.present[:amount].copy()
+        previous = np.flatnonzero(present)
+        if len(previous):
+            self.before = self.values[previous[-1]]
+            self.has_before = True
+
+        remaining = size - amount
+        self.values, old_values = np.zeros(capacity, dtype=self.values.dtype), self.values
+        self.values[:remaining] = old_values[amount:size]
+        self.present, old_present = np.zeros(capacity, dtype=bool), self.present
+        self.present[:remaining] = old_present[amount:size]
+        self.first = self.first - amount if self.first >= amount else 0
+        if self.kind == "object":
+            self.object_bytes = sum(object_size(value) for value in self.values[:remaining][self.present[:remaining]])
+
+        cached = max(self.cached - amount, 0)
+        cache = np.empty(capacity, dtype=self.cache.dtype)
+        cache[:cached] = self.cache[amount:amount + cached]
+        self.cache, self.cached = cache, cached
+        if self.carry is not None:
+            # A carry among the spilled rows is replaced by the value kept in before
+            self.carry = self.carry - amount if self.carry >= amount else -1
+        return values, present, filled
+
+
+class ArrayColumn:
+    """
+    Column of an observation that is an array with a fixed shape and dtype, like a spectrum or a camera frame. The
+    arrays are stored in blocks preallocated with shape (points, *shape), in memory or as memory mapped files, so
+    growing never copies them, and each point is read as a view of its block without copying. As they are
+    observations, the arrays aren't forward filled like the other columns.
+    """
+    kind = "array"
+
+    def __init__(self, shape: Tuple[int, ...], dtype: np.dtype, capacity: int, folder: str = None):
+        """
+        :param folder: if set, the blocks are memory mapped files in this folder instead of being in memory.
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.folder = folder
+        row_bytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.block_size = max(1, min(ARRAY_BLOCK_BYTES // row_bytes, capacity))
+        self.blocks: List[np.ndarray] = []
+        self.files: List[str] = []  # The file of each block, when they are on disk
+        self.base = 0  # Position of the first row in the first block, the previous ones were spilled
+        self.present = np.zeros(0, dtype=bool)
+        self.views: np.ndarray = None  # Cache of filled
+        self.cached = 0
+        self.grow(capacity)
+
+    def new_block(self) -> np.ndarray:
+        shape = (self.block_size,) + self.shape
+        if self.folder is None:
+            return np.zeros(shape, dtype=self.dtype)
+        makedirs(self.folder, exist_ok=True)
+        handle, filename = mkstemp(suffix=".dat", dir=self.folder)
+        close(handle)
+        self.files.append(filename)
+        return np.memmap(filename, dtype=self.dtype, mode="w+", shape=shape)
+
+    def remove_file(self, filename: str):
+        # On Linux the views of the block stay valid, elsewhere the file can't be removed while they exist
+        try:
+            remove(filename)
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Removes the files of the blocks, if they are on disk. The column can't be used afterwards.
+        """
+        for filename in self.files:
+            self.remove_file(filename)
+        self.files.clear()
+        self.blocks.clear()
+
+    def grow(self, capacity: int):
+        present = np.zeros(capacity, dtype=bool)
+        present[:len(self.present)] = self.present[:capacity]
+        self.present = present
+        while len(self.blocks) * self.block_size - self.base < capacity:
+            self.blocks.append(self.new_block())
+
+    def locate(self, index: int) -> Tuple[np.ndarray, int]:
+        row = index + self.base
+        return self.blocks[row // self.block_size], row % self.block_size
+
+    def set(self, index: int, value: Any):
+        value = np.asarray(value)
+        if value.shape != self.shape:
+            raise Exception(f"An array of shape {value.shape} doesn't match the shape {self.shape} of its column")
+        block, row = self.locate(index)
+        block[row] = value
+        self.present[index] = True
+        self.cached = min(self.cached, index)
+
+    def get(self, index: int) -> np.ndarray:
+        # A view of the array, it must not be modified
+        block, row = self.locate(index)
+        return block[row]
+
+    def rows(self, rows: np.ndarray) -> np.ndarray:
+        """
+        :return: a copy of the arrays of the given rows, with shape (rows, *shape).
+        """
+        physical = np.asarray(rows) + self.base
+        result = np.empty((len(physical),) + self.shape, dtype=self.dtype)
+        blocks = physical // self.block_size
+        for block in np.unique(blocks):
+            in_block = blocks == block
+            result[in_block] = self.blocks[block][physical[in_block] % self.block_size]
+        missing = ~self.present[rows]
+        if missing.any():
+            result[missing] = missing_arrays(self.shape, self.dtype, 1)
+        return result
+
+    def filled(self, size: int) -> np.ndarray:
+        """
+        :return: an object array with a view of the array of each of the first size points, or NaN if the point
+        doesn't have one.
+        """
+        if self.views is None or len(self.views) < size:
+            views = np.full(max(size, len(self.present)), float("NaN"), dtype=object)
+            if self.views is not None:
+                views[:self.cached] = self.views[:self.cached]
+            self.views = views
+        for row in range(self.cached, size):
+            self.views[row] = self.get(row) if self.present[row] else float("NaN")
+        self.cached = max(self.cached, size)
+        return self.views[:size]
+
+    def nbytes(self) -> int:
+        # The memory mapped blocks are on disk
+        views = 0 if self.views is None else self.views.nbytes
+        return self.present.nbytes + views + sum(block.nbytes for block in self.blocks
+                                                 if not isinstance(block, np.memmap))
+
+    def spill(self, amount: int, size: int, capacity: int) -> Tuple[np.ndarray, np.ndarray, None]:
+        """
+        Removes the first amount rows, the blocks that only had removed rows are released.
+
+        :return: the arrays and presence of the removed rows.
+        """
+        values, present = self.rows(np.arange(amount)), self.present[:amount].copy()
+        self.base += amount
+        while self.base >= self.block_size:
+            self.blocks.pop(0)
+            if self.files:
+                self.remove_file(self.files.pop(0))
+            self.base -= self.block_size
+        self.present = self.present[amount:size]
+        self.views, self.cached = None, 0
+        self.grow(capacity)
+        return values, present, None
+
+    def state(self, size: int) -> Tuple:
+        return self.kind, self.rows(np.arange(size)), self.present[:size].copy()
+
+    def load(self, values: np.ndarray, present: np.ndarray):
+        for row in np.flatnonzero(present):
+            self.set(row, values[row])
+
+
+class PointRecord:
+    """
+    Slot reserved by DataRepository.reserve for the data of a point that is being measured. Each component writes its
+    own dictionary, so several observers can fill the record at the same time without locks. The point only becomes
+    visible to the readers of the repository when the record is published, with all its data at once.
+    """
+    __slots__ = ("run", "point", "data", "index")
+
+    def __init__(self, run: int, point: int = None):
+        self.run = run
+        self.point = point
+        self.data: Dict[str, Dict[str, Any]] = {}
+        self.index = -1  # Index of the point in the repository, set when it's published
+
+    def add_datum(self, name: str, datum: Dict[str, Any]):
+        # setdefault is atomic, and each component then updates only its own dictionary
+        self.data.setdefault(name, {}).update(datum)
+
 
 class DataRepository(LogMixin):
+    """
+    Columnar storage of the data of the experiment. Each (component, variable) pair is a typed NumPy column with a
+    presence bitmap, and the run and logical point of each row are kept in their own arrays, with an index of the
+    rows of each run. The data of a point is still read and written as a dictionary of components.
+
+    With a memory budget, once the arrays in memory exceed it the finished points of the completed runs, or the
+    oldest half of the finished points of the current run, are spilled to .npy files and removed from memory. The
+    spilled points are read back transparently by every method, so the indices of the points never change.
+    """
     run_number: int
 
-    def __init__(self):
+    def __init__(self, memory_budget: int = None, spill_folder: str = None, trace: bool = False,
+                 arrays_on_disk: bool = False):
+        """
+        :param memory_budget: maximum amount of bytes of the data kept in memory, or None to keep every point.
+        :param spill_folder: folder where the spilled points are written. If None, a temporary folder is created.
+        :param trace: if True, tracemalloc is started and the peak memory of the process is recorded for each run.
+        :param arrays_on_disk: if True, the array observations are stored in memory mapped files in the spill folder.
+        """
         self.logger = get_logger("SER.Core.Dispatcher")
-        self.data: List[Dict[str, Dict[str, Any]]] = []
+        self.lock = Lock()  # Held while the arrays are replaced, as the interface reads them from another thread
+        self.capacity = INITIAL_CAPACITY
+        self.size = 0
+        self.columns: Dict[Tuple[str, str], Union[Column, ArrayColumn]] = {}
+        self.declared: Set[Tuple[str, str]] = set()  # The array columns declared with observe_arrays
+        self.runs = np.zeros(self.capacity, dtype=np.int64)
+        self.points = np.full(self.capacity, -1, dtype=np.int64)
+        self.run_index: Dict[int, List[int]] = {}  # The [start, stop) rows of each run
         self.run_number = 0
+        self.finished = -1  # Index of the last point whose data is complete
+
+        # The points before offset were spilled to the chunks, the arrays in memory start at the point offset
+        self.memory_budget = memory_budget
+        self.spill_folder = spill_folder
+        self.offset = 0
+        self.chunks: List[Chunk] = []
+        self.arrays_on_disk = arrays_on_disk
+        self.loaded: Tuple[Chunk, Dict[str, np.ndarray]] = (None, {})  # Last chunk read by get_datum_index
+
+        self.trace = trace
+        self.run_peaks: Dict[int, int] = {}  # Peak memory traced by tracemalloc during each run
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        # The exports are cached and shared between their consumers, the version changes with every write
+        self.version = 0
+        self.frame: pd.DataFrame = None
+        self.frame_version = -1
+        self.rows: List[Dict[str, Dict[str, Any]]] = []  # Cache of to_internal_repr
+        self.rows_header: List[Tuple[str, str]] = []
+        self.rows_valid = 0  # Amount of cached rows without later writes
+        self.sorted_rows: List[Dict[str, Dict[str, Any]]] = []  # The cached rows in the order of the exports
+        self.sorted_version = -1
+
+        # If set, every finished point is queued to be written to disk
+        self.writer = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def grow(self):
+        with self.lock:
+            self.capacity *= 2
+            for column in self.columns.values():
+                column.grow(self.capacity)
+            resident = self.size - self.offset
+            runs = np.zeros(self.capacity, dtype=np.int64)
+            runs[:resident] = self.runs[:resident]
+            points = np.full(self.capacity, -1, dtype=np.int64)
+            points[:resident] = self.points[:resident]
+            self.runs, self.points = runs, points
 
-    def next(self):
-        # TODO: document this name
-        self.data.append({"run": {"id": self.run_number}})
+    def next(self, point: int = None, run: int = None) -> int:
+        """
+        Adds a new point to the repository.
+
+        :param point: the logical index of the point in the run, its position in raster order.
+        :param run: the run of the point, the current one if None.
+        :return: the index of the point, used to add data to it while other points are being measured.
+        """
+        if self.size - self.offset == self.capacity:
+            self.grow()
+        run = self.run_number if run is None else run
+        index = self.size
+        self.runs[index - self.offset] = run
+        self.points[index - self.offset] = -1 if point is None else point
+        self.run_index.setdefault(run, [index, index])[1] = index + 1
+        self.size += 1
+        self.version += 1
+        return index
+
+    def reserve(self, point: int = None) -> PointRecord:
+        """
+        Reserves a record for a point of the current run, that is filled while it's measured and added to the
+        repository with publish.
+
+        :param point: the logical index of the point in the run, its position in raster order.
+        """
+        return PointRecord(self.run_number, point)
+
+    def publish(self, record: PointRecord) -> int:
+        """
+        Adds the point of the record with all its data and finishes it. Readers in other threads either don't see
+        the point or see it complete.
+
+        :return: the index of the point.
+        """
+        if self.size - self.offset == self.capacity:
+            self.grow()
+        with self.lock:
+            record.index = self.next(record.point, record.run)
+            for name, datum in record.data.items():
+                self.write_values(name, datum, record.index)
+            self.version += 1
+        self.finish(record.index)
+        return record.index
 
     def next_run(self):
+        if self.trace and tracemalloc.is_tracing():
+            self.run_peaks[self.run_number] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
         self.run_number += 1
 
-    def add_datum(self, name: str, datum: Dict[str, Any]):
-        self.data[-1][name] = datum
+    def add_datum(self, name: str, datum: Dict[str, Any], index: int = -1):
+        if index < 0:
+            index += self.size
+        if index < self.offset:
+            raise Exception(f"The point {index} was already spilled to disk")
+        with self.lock:
+            self.write_values(name, datum, index)
+            self.version += 1
+
+    def write_values(self, name: str, datum: Dict[str, Any], index: int):
+        # Must be called holding the lock
+        for variable, value in datum.items():
+            # The arrays from the worker processes are copied from their shared memory, which is then released
+            handle = value if isinstance(value, SharedArray) else None
+            if handle is not None:
+                value = handle.array()
+            column = self.columns.get((name, variable))
+            if column is None:
+                if isinstance(value, np.ndarray) and value.ndim > 0:
+                    column = self.new_array_column(value.shape, value.dtype)
+                else:
+                    column = Column(value_kind(value), self.capacity)
+                self.columns[(name, variable)] = column
+            elif column.kind == "array" and (name, variable) not in self.declared and \
+                    np.shape(value) != column.shape:
+                # An undeclared array whose shape changes, like the samples of a stream, is kept as an object
+                column = self.object_column(column)
+                self.columns[(name, variable)] = column
+            if handle is not None and column.kind != "array":
+                value = value.copy()
+            column.set(index - self.offset, value)
+            if handle is not None:
+                handle.release()
+        self.rows_valid = min(self.rows_valid, index)
+
+    def folder(self) -> str:
+        # The folder of the spilled points and the arrays stored on disk
+        if self.spill_folder is None:
+            self.spill_folder = mkdtemp(prefix="SER-")
+        return self.spill_folder
+
+    def new_array_column(self, shape: Tuple[int, ...], dtype: Any) -> ArrayColumn:
+        folder = path.join(self.folder(), "arrays") if self.arrays_on_disk else None
+        return ArrayColumn(shape, dtype, self.capacity, folder)
+
+    def object_column(self, column: ArrayColumn) -> Column:
+        # Must be called holding the lock
+        result = Column("object", self.capacity)
+        for row in np.flatnonzero(column.present):
+            result.set(row, column.get(row).copy())
+        column.close()
+        return result
+
+    def declare_array(self, name: str, variable: str, shape: Tuple[int, ...], dtype: Any):
+        """
+        Creates the column of an array observation before its first value, so its storage is preallocated.
+        """
+        with self.lock:
+            if (name, variable) not in self.columns:
+                self.columns[(name, variable)] = self.new_array_column(shape, dtype)
+            self.declared.add((name, variable))
+
+    def finish(self, index: int):
+        """
+        Marks the point as complete, making it the one returned by last_datum, and queues it in the writer. If the
+        memory budget is exceeded, the oldest finished points are spilled to disk.
+        """
+        self.finished = index
+        if self.writer is not None:
+            self.writer.write(self.get_datum_index(index))
+        if self.memory_budget is not None and self.resident_bytes() > self.memory_budget:
+            self.spill()
 
     def last_datum(self):
-        return self.data[-1]
+        return self.get_datum_index(self.finished)
 
-    def get_datum_index(self, index):
-        return self.data[index]
+    def run_rows(self, run: int) -> slice:
+        """
+        :return: the rows of the given run.
+        """
+        start, stop = self.run_index.get(run, (0, 0))
+        return slice(start, stop)
 
-    def to_internal_repr(self) -> List[Dict[str, Dict[str, Any]]]:
-        header: set[Tuple[str, str]] = set()
-        for item in self.data:
-            for k, v in item.items():
-                for sub_k in v:
-                    header.add((k, sub_k))
-
-        vals = []
-        for line in self.data:
-            line_val = {}
-            for k, v in header:
-                if k not in line_val:
-                    line_val[k] = {}
-
-                if k in line and v in line[k]:
-                    line_val[k][v] = line[k][v]
-                elif len(vals) > 0 and k in vals[-1] and v in vals[-1][k]:
-                    line_val[k][v] = vals[-1][k][v]
+    def resident_bytes(self) -> int:
+        """
+        :return: the size of the arrays kept in memory, including the objects referenced by the object columns.
+        """
+        return self.runs.nbytes + self.points.nbytes + sum(column.nbytes() for column in self.columns.values())
+
+    def spill(self):
+        """
+        Writes the finished points of the completed runs to a new chunk on disk, or the oldest half of the finished
+        points if the current run is the only one in memory, and removes them from memory.
+        """
+        finished = self.finished + 1
+        current = min(self.run_index.get(self.run_number, [self.size])[0], finished)
+        stop = max(current, self.offset + (finished - self.offset) // 2)
+        amount = stop - self.offset
+        if amount <= 0 or (amount < SPILL_MINIMUM and stop != current):
+            return
+
+        directory = path.join(self.folder(), f"chunk_{len(self.chunks)}")
+        makedirs(directory, exist_ok=True)
+        chunk = Chunk(directory, self.offset, stop, {key: column.kind for key, column in self.columns.items()})
+        resident = self.size - self.offset
+        capacity = capacity_for(resident - amount)
+
+        with self.lock:
+            chunk.save("runs", self.runs[:amount])
+            chunk.save("points", self.points[:amount])
+            for key, column in self.columns.items():
+                values, present, filled = column.spill(amount, resident, capacity)
+                i = chunk.keys[key]
+                chunk.save(f"{i}.values", values)
+                chunk.save(f"{i}.present", present)
+                if filled is not None:
+                    chunk.save(f"{i}.filled", filled)
+            runs, points = np.zeros(capacity, dtype=np.int64), np.full(capacity, -1, dtype=np.int64)
+            runs[:resident - amount] = self.runs[amount:resident]
+            points[:resident - amount] = self.points[amount:resident]
+            self.runs, self.points, self.capacity = runs, points, capacity
+            self.chunks.append(chunk)
+            self.offset = stop
+        self.log_debug(f"Spilled {amount} points to {directory} ({chunk.bytes} bytes)")
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """
+        :return: the resident size of the data and the statistics of the spilled points. If trace is enabled, it
+        includes the memory traced by tracemalloc and its peak during each run.
+        """
+        resident = self.size - self.offset
+        row_bytes = self.resident_bytes() / max(resident, 1)
+        stats = {
+            "resident_bytes": self.resident_bytes(),
+            "memory_budget": self.memory_budget,
+            "resident_points": resident,
+            "spilled_points": self.offset,
+            "spilled_bytes": sum(chunk.bytes for chunk in self.chunks),
+            "chunks": len(self.chunks),
+            # The points of each run still in memory, times the average size of a point
+            "run_bytes": {run: int(max(min(stop, self.size) - max(start, self.offset), 0) * row_bytes)
+                          for run, (start, stop) in self.run_index.items()},
+        }
+        if self.trace and tracemalloc.is_tracing():
+            stats["traced_bytes"], peak = tracemalloc.get_traced_memory()
+            stats["run_peaks"] = {**self.run_peaks, self.run_number: peak}
+        return stats
+
+    def state(self) -> Dict[str, Any]:
+        """
+        :return: the finished points and the run number, to be saved in a checkpoint. The spilled points are saved
+        as references to their chunks, which have to be kept to resume.
+        """
+        size = self.finished + 1 - self.offset
+        with self.lock:
+            return {
+                "columns": {key: column.state(size) for key, column in self.columns.items()},
+                "runs": self.runs[:size].copy(),
+                "points": self.points[:size].copy(),
+                "run_number": self.run_number,
+                "offset": self.offset,
+                "chunks": list(self.chunks),
+                "run_index": {run: [start, min(stop, self.finished + 1)] for run, (start, stop)
+                              in self.run_index.items() if start <= self.finished},
+            }
+
+    def restore(self, state: Dict[str, Any]):
+        """
+        Replaces the contents of the repository with a state returned by the method state.
+        """
+        resident = len(state["runs"])
+        offset = state.get("offset", 0)
+        with self.lock:
+            self.capacity = capacity_for(resident)
+            self.offset = offset
+            self.size = offset + resident
+            self.chunks = state.get("chunks", [])
+            self.loaded = (None, {})
+            for column in self.columns.values():
+                if column.kind == "array":
+                    column.close()
+            self.columns = {}
+            for key, (kind, values, present, *before) in state["columns"].items():
+                if kind == "array":
+                    column = self.columns[key] = self.new_array_column(values.shape[1:], values.dtype)
+                    column.load(values, present)
+                    continue
+                column = self.columns[key] = Column(kind, self.capacity)
+                column.values[:resident] = values
+                column.present[:resident] = present
+                previous = np.flatnonzero(present)
+                column.first = int(previous[0]) if len(previous) else NO_ROW
+                if before:
+                    column.has_before, column.before = before
+                if kind == "object":
+                    column.object_bytes = sum(object_size(value) for value in values[present])
+            self.runs = np.zeros(self.capacity, dtype=np.int64)
+            self.runs[:resident] = state["runs"]
+            self.points = np.full(self.capacity, -1, dtype=np.int64)
+            self.points[:resident] = state["points"]
+            if "run_index" in state:
+                self.run_index = {run: list(rows) for run, rows in state["run_index"].items()}
+            else:
+                self.run_index = {}
+                for run in np.unique(self.runs[:resident]):
+                    rows = np.flatnonzero(self.runs[:resident] == run)
+                    self.run_index[int(run)] = [int(rows[0]), int(rows[-1]) + 1]
+            self.run_number = state["run_number"]
+            self.finished = self.size - 1
+            self.rows, self.rows_header, self.rows_valid = [], [], 0
+            self.version += 1
+
+    def chunk_of(self, index: int) -> Tuple[Chunk, Dict[str, np.ndarray]]:
+        # The arrays of the chunk with the point, the last one is kept as points are usually read in order
+        chunk, arrays = self.loaded
+        if chunk is None or not chunk.start <= index < chunk.stop:
+            chunk = next(chunk for chunk in self.chunks if chunk.start <= index < chunk.stop)
+            arrays = {"runs": chunk.load("runs"), "points": chunk.load("points")}
+            for key in chunk.keys:
+                arrays[key] = (chunk.column(key, "values"), chunk.column(key, "present"))
+            self.loaded = (chunk, arrays)
+        return chunk, arrays
+
+    def get_datum_index(self, index: int) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: the data of the point as a dictionary of components, with only the variables the point has.
+        """
+        if index < 0:
+            index += self.size
+        if index < self.offset:
+            chunk, arrays = self.chunk_of(index)
+            row = index - chunk.start
+            datum = {"run": {"id": int(arrays["runs"][row])}}
+            if arrays["points"][row] >= 0:
+                datum["run"]["point"] = int(arrays["points"][row])
+            for (name, variable), kind in chunk.kinds.items():
+                values, present = arrays[(name, variable)]
+                if present[row]:
+                    value = values[row]
+                    datum.setdefault(name, {})[variable] = value if kind in ("object", "array") else value.item()
+            return datum
+
+        with self.lock:
+            row = index - self.offset
+            datum = {"run": {"id": int(self.runs[row])}}
+            if self.points[row] >= 0:
+                datum["run"]["point"] = int(self.points[row])
+            for (name, variable), column in self.columns.items():
+                if column.present[row]:
+                    datum.setdefault(name, {})[variable] = column.get(row)
+            return datum
+
+    def filled_columns(self) -> Dict[Tuple[str, str], np.ndarray]:
+        """
+        :return: every column with its missing values replaced by the previous value, or NaN if there is none. The
+        times of the points are converted to datetimes, and the spilled points are read from disk.
+        """
+        with self.lock:
+            resident = self.size - self.offset
+            runs = np.concatenate([chunk.load("runs") for chunk in self.chunks] + [self.runs[:resident]])
+            points = np.concatenate([chunk.load("points") for chunk in self.chunks] + [self.points[:resident]])
+            result = {("run", "id"): runs}
+            if (points >= 0).any():
+                result[("run", "point")] = points
+            for key, column in self.columns.items():
+                if key[0] == TIME_COMPONENT and column.kind == "int":
+                    result[key] = np.concatenate(
+                        [time_values(chunk.column(key, "values"), chunk.column(key, "present")) if key in chunk.keys
+                         else missing_values("datetime", chunk.stop - chunk.start) for chunk in self.chunks] +
+                        [time_values(column.values[:resident], column.present[:resident])])
+                    continue
+                filled = column.filled(resident)
+                if self.chunks:
+                    filled = np.concatenate([chunk.filled(key, column.kind) for chunk in self.chunks] + [filled])
+                result[key] = filled
+            return result
+
+    def export_order(self) -> Tuple[List[Tuple[str, str]], np.ndarray]:
+        """
+        :return: the columns of the data sorted by their name, and the index of the points in the order they are
+        exported, by run and logical point like to_dataframe.
+        """
+        with self.lock:
+            resident = self.size - self.offset
+            runs = np.concatenate([chunk.load("runs") for chunk in self.chunks] + [self.runs[:resident]])
+            points = np.concatenate([chunk.load("points") for chunk in self.chunks] + [self.points[:resident]])
+            keys = [("run", "id")] + [("run", "point")] * bool((points >= 0).any()) + list(self.columns)
+        keys.sort(key=lambda key: f"{key[0]}_{key[1]}")
+        order = np.lexsort((points, runs)) if ("run", "point") in keys else np.arange(len(runs))
+        return keys, order
+
+    def gather(self, rows: np.ndarray, resident: Callable[[np.ndarray], np.ndarray],
+               spilled: Callable[[Chunk], np.ndarray]) -> np.ndarray:
+        # The values of the given points, taken from the arrays in memory or from the chunks that have them
+        if not self.chunks or rows.min(initial=self.offset) >= self.offset:
+            return resident(rows - self.offset)
+        parts = []
+        in_memory = rows >= self.offset
+        if in_memory.any():
+            parts.append((in_memory, resident(rows[in_memory] - self.offset)))
+        for chunk in self.chunks:
+            in_chunk = (rows >= chunk.start) & (rows < chunk.stop)
+            if in_chunk.any():
+                parts.append((in_chunk, np.asarray(spilled(chunk))[rows[in_chunk] - chunk.start]))
+        try:
+            dtype = np.result_type(*[part.dtype for _, part in parts])
+        except TypeError:
+            dtype = np.dtype("object")
+        result = np.empty((len(rows),) + parts[0][1].shape[1:], dtype=dtype)
+        for mask, part in parts:
+            result[mask] = part
+        return result
+
+    def export_rows(self, keys: List[Tuple[str, str]], rows: np.ndarray) -> Dict[Tuple[str, str], np.ndarray]:
+        """
+        Reads a part of the data to be exported, so the whole data doesn't need to be copied at once.
+
+        :param keys: the columns returned by export_order.
+        :param rows: the index of the points, a slice of the order returned by export_order.
+        :return: the given columns of the given points, forward filled and with the times as datetimes. The arrays
+        of the array observations are stacked, with shape (points, *shape).
+        """
+        result = {}
+        with self.lock:
+            resident = self.size - self.offset
+            for key in keys:
+                column = self.columns.get(key)
+                if key == ("run", "id"):
+                    result[key] = self.gather(rows, self.runs.__getitem__, lambda chunk: chunk.load("runs"))
+                elif key == ("run", "point"):
+                    result[key] = self.gather(rows, self.points.__getitem__, lambda chunk: chunk.load("points"))
+                elif column.kind == "array":
+                    result[key] = self.gather(rows, column.rows, lambda chunk: chunk.column(key, "values") if key
+                                              in chunk.keys else missing_arrays(column.shape, column.dtype,
+                                                                                chunk.stop - chunk.start))
+                elif key[0] == TIME_COMPONENT and column.kind == "int":
+                    values = self.gather(rows, column.values.__getitem__, lambda chunk: chunk.column(key, "values")
+                                         if key in chunk.keys else np.zeros(chunk.stop - chunk.start, dtype=np.int64))
+                    present = self.gather(rows, column.present.__getitem__, lambda chunk: chunk.column(key, "present")
+                                          if key in chunk.keys else np.zeros(chunk.stop - chunk.start, dtype=bool))
+                    result[key] = time_values(values, present)
                 else:
-                    line_val[k][v] = float("NaN")
-            vals.append(line_val)
-        return vals
+                    result[key] = self.gather(rows, column.filled(resident).__getitem__,
+                                              lambda chunk: chunk.filled(key, column.kind))
+        return result
 
-    def to_dataframe(self) -> pd.DataFrame:
-        header: set[Tuple[str, str]] = set()
-        for item in self.data:
-            for k, v in item.items():
-                for sub_k in v:
-                    header.add((k, sub_k))
-
-        vals = []
-        for line in self.data:
+    def to_internal_repr(self) -> List[Dict[str, Dict[str, Any]]]:
+        """
+        :return: a dictionary of components for each point, with every variable forward filled, sorted by run and
+        logical point like to_dataframe. The list is cached and shared with every caller, so it must not be modified.
+        Only the rows added or written since the previous call are rebuilt.
+        """
+        columns = self.filled_columns()
+        header = list(columns.keys())
+        if header != self.rows_header:
+            # A new variable appeared, so every row needs it
+            self.rows, self.rows_header, self.rows_valid = [], header, 0
+        start = min(self.rows_valid, len(self.rows))
+        # The times are converted to microseconds, as tolist only gives datetime objects with that resolution
+        values = {key: (array[start:].astype("datetime64[us]") if array.dtype.kind == "M" else array[start:]).tolist()
+                  for key, array in columns.items()}
+        del self.rows[start:]
+        for row in range(len(columns[("run", "id")]) - start):
             line_val = {}
-            for k, v in header:
-                if k in line:
-                    line_val[f"{k}_{v}"] = line[k][v]
-                elif len(vals) > 0 and f"{k}_{v}" in vals[-1]:
-                    line_val[f"{k}_{v}"] = vals[-1][f"{k}_{v}"]
-                else:
-                    line_val[f"{k}_{v}"] = float("NaN")
-            vals.append(line_val)
+            for (name, variable), column in values.items():
+                line_val.setdefault(name, {})[variable] = column[row]
+            self.rows.append(line_val)
+        self.rows_valid = len(self.rows)
+
+        # The rows are built in the order they were measured, so they can be extended, and a traversal may measure
+        # the points out of their logical order. Sorting them is only needed in that case.
+        if ("run", "point") not in columns:
+            return self.rows
+        runs, points = columns[("run", "id")], columns[("run", "point")]
+        run_steps = np.diff(runs)
+        if ((run_steps > 0) | ((run_steps == 0) & (np.diff(points) >= 0))).all():
+            return self.rows
+        if self.sorted_version != self.version:
+            self.sorted_rows = [self.rows[i] for i in np.lexsort((points, runs))]
+            self.sorted_version = self.version
+        return self.sorted_rows
 
-        df = pd.DataFrame(vals)
-        return df[sorted(df.columns)]
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        :return: the data as a DataFrame with a column for each variable, named {component}_{variable}. It's cached
+        until new data arrives and shared with every caller, so it must not be modified.
+        """
+        version = self.version
+        if self.frame_version == version:
+            return self.frame
+        columns = self.filled_columns()
+        df = pd.DataFrame({f"{name}_{variable}": values for (name, variable), values in columns.items()}, copy=False)
+        df = df[sorted(df.columns)]
+        # The points are exported in their logical order, as a traversal may measure them in a different order. The
+        # forward fill above is done before, as it follows the order in which the instruments were configured.
+        if "run_point" in df.columns:
+            df = df.sort_values(["run_id", "run_point"], kind="stable").reset_index(drop=True)
+        self.frame, self.frame_version = df, version
+        return df
 
     def to_csv(self, filename: str):
         self.to_dataframe().to_csv(filename)
 
     def to_matlab(self, filename: str):
-        df = self.to_dataframe()
+        # The arrays of the array observations are stacked, so each one is a matrix with a row for each point
+        keys, order = self.export_order()
         mat_dict = {}
-        for column in df.columns:
-            column: str
-            column = column.replace(" ", "_")
+        for (name, variable), values in self.export_rows(keys, order).items():
+            column = f"{name}_{variable}".replace(" ", "_")
             if column in mat_dict:
                 self.log_error("Matlab column name collision!")
-            mat_dict[column] = df[column].to_numpy(copy=True)
+            mat_dict[column] = values.astype("datetime64[us]").astype(str) if values.dtype.kind == "M" else values
         savemat(filename, mat_dict)
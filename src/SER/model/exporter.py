@@ -0,0 +1,313 @@
+import json
+from os import path
+from threading import Thread
+from traceback import format_exc
+from typing import Dict, Tuple, Callable, List
+
+import numpy as np
+import pandas as pd
+from lantz.core.log import get_logger
+from pimpmyclass.mixins import LogMixin
+
+from .data_repository import DataRepository
+
+# The columnar formats are optional, each one needs its library
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# The format of each file extension
+FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".h5": "hdf5",
+    ".hdf5": "hdf5",
+    ".mat": "mat",
+}
+
+# Days from the year 0 of MATLAB's datenum to the epoch
+DATENUM_EPOCH = 719529
+
+
+def column_name(key: Tuple[str, str]) -> str:
+    # The same names as the columns of DataRepository.to_dataframe
+    return f"{key[0]}_{key[1]}"
+
+
+def matlab_name(name: str) -> str:
+    # MATLAB variables can only have letters, numbers and underscores
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def nested_lists(values: np.ndarray) -> np.ndarray:
+    # The rows of an array column as nested lists, which are written as text like JSON
+    rows = np.empty(len(values), dtype=object)
+    rows[:] = [row.tolist() for row in values]
+    return rows
+
+
+class CsvSink:
+    def __init__(self, filename: str, size: int):
+        self.file = open(filename, "w", newline="", encoding="utf-8")
+        self.header = True
+
+    def write(self, start: int, columns: Dict[str, np.ndarray]):
+        columns = {name: nested_lists(values) if values.ndim > 1 else values for name, values in columns.items()}
+        df = pd.DataFrame(columns, copy=False)
+        df.index = pd.RangeIndex(start, start + len(df))
+        df.to_csv(self.file, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowFileSink:
+    """
+    Writes the chunks as record batches of an Arrow IPC file, or as row groups of a Parquet file. The arrays of the
+    array observations are fixed size lists with the values in C order, and their shape in the metadata of the field.
+    """
+
+    def __init__(self, filename: str, size: int, parquet: bool = False):
+        self.filename = filename
+        self.parquet = parquet
+        self.writer = None
+        self.file = None
+        self.schema = None
+
+    def table(self, columns: Dict[str, np.ndarray]) -> "pa.Table":
+        flat = {name: values for name, values in columns.items() if values.ndim == 1}
+        table = pa.Table.from_pandas(pd.DataFrame(flat, copy=False), preserve_index=False)
+        arrays, fields = [], []
+        for name, values in columns.items():
+            if values.ndim == 1:
+                arrays.append(table.column(name))
+                fields.append(table.schema.field(name))
+            else:
+                width = int(np.prod(values.shape[1:]))
+                arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), width))
+                fields.append(pa.field(name, arrays[-1].type, metadata={"shape": json.dumps(values.shape[1:])}))
+        return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+    def write(self, start: int, columns: Dict[str, np.ndarray]):
+        if self.schema is None:
+            table = self.table(columns)
+            self.schema = table.schema
+            if self.parquet:
+                self.writer = pa.parquet.ParquetWriter(self.filename, self.schema)
+            else:
+                self.file = pa.OSFile(self.filename, "wb")
+                self.writer = pa.ipc.new_file(self.file, self.schema)
+        else:
+            table = self.table(columns).cast(self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.file is not None:
+            self.file.close()
+
+
+class Hdf5Sink:
+    """
+    Writes each column as a dataset of an HDF5 file, created with the size of the whole export when its first chunk
+    arrives. The times are stored as int64 nanoseconds since the epoch, the objects as strings, and the arrays of the
+    array observations as datasets with shape (points, *shape).
+    """
+
+    def __init__(self, filename: str, size: int):
+        self.file = h5py.File(filename, "w")
+        self.size = size
+        self.datasets = {}
+
+    def convert(self, values: np.ndarray) -> Tuple[np.ndarray, Dict[str, str]]:
+        if values.dtype.kind == "M":
+            return values.astype("datetime64[ns]").view(np.int64), {"unit": "ns since epoch"}
+        if values.dtype.kind == "O":
+            return np.array([str(value) for value in values], dtype=h5py.string_dtype()), {}
+        return values, {}
+
+    def create(self, name: str, values: np.ndarray, attributes: Dict[str, str]) -> "h5py.Dataset":
+        dataset = self.file.create_dataset(name, (self.size,) + values.shape[1:], dtype=values.dtype)
+        dataset.attrs.update(attributes)
+        return dataset
+
+    def write(self, start: int, columns: Dict[str, np.ndarray]):
+        for name, values in columns.items():
+            values, attributes = self.convert(values)
+            if name not in self.datasets:
+                self.datasets[name] = self.create(name, values, attributes)
+            self.datasets[name][start:start + len(values)] = values
+
+    def close(self):
+        self.file.close()
+
+
+class MatSink(Hdf5Sink):
+    """
+    Writes a MAT-file v7.3, which is an HDF5 file with a MATLAB header, so it doesn't have the 2 GB limit of the
+    previous versions. Each column is a column vector, the times are datenums and the objects are char matrices. The
+    arrays of the array observations have a row for each point, so a spectrum column is a points x length matrix.
+    """
+    header = b"MATLAB 7.3 MAT-file, Platform: GLNXA64, Created by: SER. HDF5 schema 1.00 ."
+
+    def __init__(self, filename: str, size: int, widths: Dict[str, int]):
+        """
+        :param widths: the length of the longest value of each object column, as a char matrix has fixed width.
+        """
+        self.filename = filename
+        self.file = h5py.File(filename, "w", userblock_size=512)
+        self.size = size
+        self.widths = widths
+        self.datasets = {}
+
+    def convert(self, values: np.ndarray) -> Tuple[np.ndarray, Dict[str, str]]:
+        if values.dtype.kind == "M":
+            days = values.astype("datetime64[ns]").astype(np.int64) / 86400e9 + DATENUM_EPOCH
+            days[np.isnat(values)] = np.nan
+            return days, {"MATLAB_class": "double"}
+        if values.dtype.kind == "O":
+            return np.array([str(value) for value in values]), {"MATLAB_class": "char"}
+        if values.dtype.kind == "b":
+            return values.astype(np.uint8), {"MATLAB_class": "logical"}
+        return values, {"MATLAB_class": {"i": "int64", "u": "uint64"}.get(values.dtype.kind, "double")}
+
+    def create(self, name: str, values: np.ndarray, attributes: Dict[str, str]) -> "h5py.Dataset":
+        # MATLAB reads the dimensions in the opposite order, so (1, n) is a column vector of n rows
+        if attributes["MATLAB_class"] == "char":
+            dataset = self.file.create_dataset(name, (self.widths[name], self.size), dtype=np.uint16)
+        else:
+            dataset = self.file.create_dataset(name, (values.shape[:0:-1] or (1,)) + (self.size,), dtype=values.dtype)
+        dataset.attrs["MATLAB_class"] = np.bytes_(attributes["MATLAB_class"])
+        return dataset
+
+    def write(self, start: int, columns: Dict[str, np.ndarray]):
+        for name, values in columns.items():
+            values, attributes = self.convert(values)
+            if name not in self.datasets:
+                self.datasets[name] = self.create(name, values, attributes)
+            stop = start + len(values)
+            if attributes["MATLAB_class"] == "char":
+                # Each value is a row of the char matrix, padded with spaces
+                width = self.widths[name]
+                chars = np.full((len(values), width), ord(" "), dtype=np.uint16)
+                for i, value in enumerate(values):
+                    chars[i, :len(value)] = [ord(c) for c in value[:width]]
+                self.datasets[name][:, start:stop] = chars.T
+            else:
+                self.datasets[name][..., start:stop] = values.T
+
+    def close(self):
+        self.file.close()
+        with open(self.filename, "r+b") as file:
+            # The header of a MAT-file is 124 bytes of text followed by the version and the endianness
+            file.write(self.header.ljust(124) + b"\x00\x02IM")
+
+
+class DataExporter(LogMixin):
+    """
+    Exports the data of a DataRepository to a file in chunks of points, so the memory used during the export is a few
+    times the size of a chunk instead of the whole data. The format is chosen by the extension of the file: .csv,
+    .parquet, .arrow or .feather (Arrow IPC), .h5 or .hdf5, and .mat (v7.3). The columnar formats need pyarrow or
+    h5py, without h5py the .mat files are written with scipy as a single chunk.
+    """
+
+    def __init__(self, data: DataRepository, filename: str, chunk_size: int = 65536):
+        """
+        :param data: the repository to export.
+        :param filename: path of the file, it's replaced if it exists.
+        :param chunk_size: amount of points read and written at once.
+        """
+        self.logger = get_logger("SER.Core.DataExporter")
+        self.data = data
+        self.filename = filename
+        self.chunk_size = chunk_size
+        extension = path.splitext(filename)[1].lower()
+        if extension not in FORMATS:
+            raise Exception(f"Unknown export format {extension}, the known ones are {', '.join(FORMATS)}")
+        self.format = FORMATS[extension]
+        if self.format in ("parquet", "arrow") and pa is None:
+            raise Exception(f"pyarrow is needed to export {extension} files")
+        if self.format == "hdf5" and h5py is None:
+            raise Exception(f"h5py is needed to export {extension} files")
+        self.thread: Thread = None
+        self.exported = 0
+        self.total = 0
+
+    def start(self, progress: Callable[[int, int], None] = None, done: Callable[[Exception], None] = None):
+        """
+        Exports the data in a background thread.
+
+        :param progress: called after each chunk with the amount of points exported and the total.
+        :param done: called at the end with the exception that stopped the export, or None if it succeeded.
+        """
+        def export():
+            error = None
+            try:
+                self.run(progress)
+            except Exception as e:
+                self.log_error(f"The data couldn't be exported to {self.filename}! {format_exc()}")
+                error = e
+            if done:
+                done(error)
+
+        self.thread = Thread(target=export, name="SER-Exporter", daemon=True)
+        self.thread.start()
+
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def chunks(self, keys: List[Tuple[str, str]], order: np.ndarray):
+        for start in range(0, len(order), self.chunk_size):
+            rows = self.data.export_rows(keys, order[start:start + self.chunk_size])
+            names = {key: matlab_name(column_name(key)) if self.format == "mat" else column_name(key) for key in rows}
+            yield start, {names[key]: values for key, values in rows.items()}
+
+    def sink(self, keys: List[Tuple[str, str]], order: np.ndarray):
+        if self.format == "csv":
+            return CsvSink(self.filename, len(order))
+        if self.format in ("parquet", "arrow"):
+            return ArrowFileSink(self.filename, len(order), parquet=self.format == "parquet")
+        if self.format == "hdf5":
+            return Hdf5Sink(self.filename, len(order))
+        # The char matrices of MATLAB need the longest value of each object column before writing
+        widths = {}
+        for _, columns in self.chunks(keys, order):
+            for name, values in columns.items():
+                if values.dtype.kind == "O":
+                    widths[name] = max(widths.get(name, 1), max((len(str(value)) for value in values), default=1))
+        return MatSink(self.filename, len(order), widths)
+
+    def run(self, progress: Callable[[int, int], None] = None):
+        """
+        Exports the data in the current thread.
+        """
+        if self.format == "mat" and h5py is None:
+            self.log_warning("h5py is not installed, the data will be exported as a MAT-file v5")
+            self.data.to_matlab(self.filename)
+            return
+
+        keys, order = self.data.export_order()
+        self.total = len(order)
+        self.exported = 0
+        sink = self.sink(keys, order)
+        try:
+            for start, columns in self.chunks(keys, order):
+                sink.write(start, columns)
+                self.exported = min(start + self.chunk_size, self.total)
+                if progress:
+                    progress(self.exported, self.total)
+        finally:
+            sink.close()
+        self.log_info(f"Exported {self.total} points to {self.filename}")
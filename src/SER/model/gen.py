@@ -1,47 +1,7 @@
-from typing import Any, Tuple, Callable, List, Generator, Self, Dict
-
-
-class MultipleArgTracker:
-    generators: List[
-        Tuple[
-            Generator,  # The generators we want to call, we store the reset function on the gen_fun variable
-            Callable  # The function that takes the args in generator
-        ]
-    ]
-
-    def __init__(self, generators: List[Callable[[], Generator]], functions: List[Callable], next_tracker: Callable,
-                 parent):
-        self.functions = functions
-        self.gen_fun = generators
-        assert len(generators) == len(functions)
-        self.reset_generators()
-        self.next = next_tracker
-        self.parent = parent
-
-    def reset_generators(self):
-        self.generators = []
-        for i in range(len(self.functions)):
-            self.generators.append((self.gen_fun[i](), self.functions[i]))
-
-    def advance(self):
-        try:
-            for generator, function in self.generators:
-                arg = next(generator)
-                function(*arg)
-        except StopIteration:
-            self.next()
-            # The 'last' MultipleArgTracker is connected to the parent calling it to stop
-            if self.parent.stopped:
-                return
-            self.reset_generators()
-            for generator, function in self.generators:
-                arg = next(generator)
-                function(*arg)
+from typing import Tuple, Callable, List, Generator, Dict
 
-    def amount(self) -> int:
-        # TODO: write this in the documentation
-        """Note that to calculate the amount of points the generator will be called in entirety once."""
-        return len(list(self.gen_fun[0]()))
+from .plan import PointSource, ScanPlan
+from ..interfaces.adaptive import AdaptivePlan
 
 
 class MetaArgTracker:
@@ -49,45 +9,104 @@ class MetaArgTracker:
     The MetaArgTracker is the class that is tasked with administering the generators for the components, and passing
     those arguments to a function. The function could be arbitrary but the actual responsibility of execution and
     task parallelization will be from the Dispatcher class.
+
+    The points are indexed through a ScanPlan, so the tracker is only a position in the plan. On each advance, the
+    functions are called for the slowest coupling level whose point changed and for every faster level.
+
+    The fastest level can instead be an AdaptivePlan, whose points depend on the observations given to record. In
+    that case the ScanPlan holds the slower levels, and the adaptive plan runs a pass for each of their points.
     """
 
-    def __init__(self, generators: List[Tuple[int, Callable[[], Generator], Callable]]):
-        self.trackers: List[MultipleArgTracker] = []
+    def __init__(self, generators: List[Tuple]):
+        """
+        :param generators: a list of (coupling, get_points, function) tuples, with an optional fourth element with a
+        function that returns the amount of points of get_points, so the plan doesn't need to run the generator to
+        count them. Instead of get_points, a PointSource or an AdaptivePlan can be given.
+        """
         self.stopped = False
         self.started = False
-
-        # First, we store the
-        couplings: Dict[int, List[Tuple[Callable[[], Generator], Callable]]]
+        self.position = -1
+        self.previous: Tuple[int, ...] = None
+
+        # The adaptive plan, if any, is kept out of the ScanPlan as its points aren't known beforehand
+        self.adaptive: AdaptivePlan = None
+        self.adaptive_function: Callable = None
+        self.outer = -1  # Position in the ScanPlan of the slower levels, when there is an adaptive plan
+        adaptive = [comp for comp in generators if isinstance(comp[1], AdaptivePlan)]
+        if adaptive:
+            if len(adaptive) > 1 or any(comp[0] >= adaptive[0][0] for comp in generators if comp is not adaptive[0]):
+                raise Exception("An adaptive plan has to be the only one in the fastest coupling level")
+            self.adaptive = adaptive[0][1]
+            self.adaptive_function = adaptive[0][2]
+            generators = [comp for comp in generators if comp is not adaptive[0]]
+
+        # First, we group the generators by coupling, ordered from the slowest to the fastest
+        couplings: Dict[int, List[Tuple[PointSource, Callable]]]
         couplings = {}
         for comp in generators:
-            if comp[0] in couplings:
-                couplings[comp[0]].append((comp[1], comp[2]))
+            if isinstance(comp[1], PointSource):
+                source = comp[1]
             else:
-                couplings[comp[0]] = [(comp[1], comp[2])]
+                source = PointSource(comp[1], comp[3] if len(comp) > 3 else None)
+            couplings.setdefault(comp[0], []).append((source, comp[2]))
 
-        sorted_gens: List[List[Tuple[Callable[[], Generator], Callable]]] = []
+        self.functions: List[List[Callable]] = []
+        levels: List[List[PointSource]] = []
         for k in sorted(couplings.keys()):
-            sorted_gens.append(couplings[k])
-
-        self.trackers.append(MultipleArgTracker(
-            [x[0] for x in sorted_gens[0]],
-            [x[1] for x in sorted_gens[0]],
-            self.stop,
-            self
-        ))
-
-        for i in range(1, len(sorted_gens)):
-            self.trackers.append(MultipleArgTracker(
-                [x[0] for x in sorted_gens[i]],
-                [x[1] for x in sorted_gens[i]],
-                self.trackers[-1].advance,
-                self
-            ))
+            levels.append([x[0] for x in couplings[k]])
+            self.functions.append([x[1] for x in couplings[k]])
+
+        self.plan = ScanPlan(levels)
+
+    def apply(self, position: int):
+        # Calls the functions of the slowest level that changed since the previous position and of every faster
+        # level, as a new pass over a faster level configures it again even if its point is the same (serpentine)
+        indices = self.plan.indices(position)
+        changed = [level for level, index in enumerate(indices)
+                   if self.previous is None or self.previous[level] != index]
+        for level in range(changed[0] if changed else len(indices), len(indices)):
+            for function, arg in zip(self.functions[level], self.plan.args(level, indices[level])):
+                function(*arg)
+        self.previous = indices
+        self.position = position
 
     def start(self):
         self.started = True
-        for tracker in self.trackers:
-            tracker.advance()
+        self.previous = None
+        if self.adaptive is not None:
+            self.advance_adaptive()
+        elif len(self.plan) == 0:
+            self.stop()
+        else:
+            self.apply(0)
+
+    def outer_amount(self) -> int:
+        # Amount of passes of the adaptive plan, a single one if it's the only level
+        return len(self.plan) if self.plan.levels else 1
+
+    def advance_adaptive(self):
+        point = self.adaptive.next_point() if self.outer >= 0 else None
+        while point is None:
+            # The pass ended, so we move the slower levels and start a new one
+            if self.outer + 1 >= self.outer_amount():
+                self.stop()
+                return
+            self.outer += 1
+            if self.plan.levels:
+                position = self.position
+                self.apply(self.outer)
+                self.position = position
+            self.adaptive.reset()
+            point = self.adaptive.next_point()
+        self.adaptive_function(*point)
+        self.position += 1
+
+    def record(self, datum: Dict):
+        """
+        Gives the data of the current point to the adaptive plan, if there is one.
+        """
+        if self.adaptive is not None:
+            self.adaptive.record(datum)
 
     def advance(self) -> bool:
         """
@@ -100,15 +119,45 @@ class MetaArgTracker:
             self.start()
             return not self.stopped
         if not self.stopped:
-            self.trackers[-1].advance()
+            if self.adaptive is not None:
+                self.advance_adaptive()
+            elif self.position + 1 >= len(self.plan):
+                self.stop()
+            else:
+                self.apply(self.position + 1)
             return not self.stopped
         return False
 
+    def seek(self, position: int):
+        """
+        Moves the tracker so the next advance goes to the given point. Every level gets its function called on that
+        advance, as the instruments could be anywhere.
+        """
+        if self.adaptive is not None and position > 0:
+            raise Exception("A run with an adaptive plan can't be resumed from a point, as its points depend on the "
+                            "previous observations")
+        self.started = True
+        self.stopped = False
+        self.previous = None
+        self.position = position - 1
+
     def stop(self):
         self.stopped = True
 
+    def logical_index(self) -> int:
+        """
+        :return: the position of the current point in raster order, which differs from the execution order when a
+        level has a traversal. With an adaptive plan it's the position in the execution order.
+        """
+        if self.adaptive is not None:
+            return self.position
+        return self.plan.index(self.previous)
+
     def points_amount(self) -> int:
-        mult = 1
-        for tracker in self.trackers:
-            mult *= tracker.amount()
-        return mult
+        """
+        :return: the amount of points of the run. With an adaptive plan it's the maximum, as a pass can end before
+        using its whole budget.
+        """
+        if self.adaptive is not None:
+            return self.outer_amount() * self.adaptive.budget
+        return len(self.plan)
@@ -0,0 +1,255 @@
+from typing import Callable, Generator, List, Tuple, Union, Iterator
+
+import numpy as np
+
+
+# Orders in which the points of a coupling level can be visited. "raster" goes from the first to the last point on each
+# pass, "serpentine" alternates the direction on each pass so the axis doesn't fly back, and "nearest" visits the
+# points in a nearest neighbour path, for explicit lists of points. "progressive" levels are refined together from
+# coarse to fine, so a low resolution picture of the whole scan is measured first.
+TRAVERSALS = ("raster", "serpentine", "nearest", "progressive")
+
+
+def refinement_depth(amount: int, depth: int) -> np.ndarray:
+    """
+    :param amount: amount of points of the level.
+    :param depth: amount of refinements, the grid of the first one has a step of 2 ** depth points.
+    :return: for each point, the first refinement whose grid contains it.
+    """
+    index = np.arange(amount)
+    # The trailing zeros of the index tell the coarsest grid that contains the point
+    trailing = np.zeros(amount, dtype=np.int64)
+    for bit in range(depth):
+        trailing += (index % (2 ** (bit + 1)) == 0)
+    return depth - trailing
+
+
+def progressive_order(shape: Tuple[int, ...]) -> np.ndarray:
+    """
+    :return: the raster positions of the points of a grid of the given shape, ordered from coarse to fine. Each
+    refinement halves the step of the grid on every axis, and within a refinement the points are in raster order.
+    """
+    depth = int(np.ceil(np.log2(max(shape)))) if shape and max(shape) > 1 else 0
+    depths = [refinement_depth(amount, depth) for amount in shape]
+    point_depth = np.zeros(shape, dtype=np.int64)
+    for axis, axis_depth in enumerate(depths):
+        point_depth = np.maximum(point_depth, axis_depth.reshape([-1 if i == axis else 1 for i in range(len(shape))]))
+    return np.argsort(point_depth.ravel(), kind="stable")
+
+
+def nearest_order(coordinates: np.ndarray) -> np.ndarray:
+    """
+    :param coordinates: array of shape (points, dimensions).
+    :return: the order of the points in a greedy nearest neighbour path that starts at the first point.
+    """
+    amount = len(coordinates)
+    order = np.zeros(amount, dtype=np.int64)
+    visited = np.zeros(amount, dtype=bool)
+    current = 0
+    for step in range(amount):
+        order[step] = current
+        visited[current] = True
+        if step + 1 < amount:
+            distances = np.sum((coordinates - coordinates[current]) ** 2, axis=1)
+            distances[visited] = np.inf
+            current = int(np.argmin(distances))
+    return order
+
+
+class PointSource:
+    """
+    Random access over the points of a get_points function. The generator is consumed lazily and its points are
+    cached, so each point is generated only once. If the amount of points is known beforehand, the length is
+    available without running the generator.
+
+    It can also be created from the structured array of get_plan, in which case no generator is involved.
+    """
+
+    def __init__(self, get_points: Callable[[], Generator] = None, amount: Callable[[], int] = None,
+                 plan: np.ndarray = None, name: str = "", traversal: str = "raster"):
+        """
+        :param get_points: function returning the generator of points.
+        :param amount: function returning the amount of points of the generator.
+        :param plan: structured array with a field for each argument of configure, used instead of get_points.
+        :param name: name of the component, used to name the fields of the table of the ScanPlan.
+        :param traversal: order in which the points of the coupling level are visited, one of TRAVERSALS.
+        """
+        if traversal not in TRAVERSALS:
+            raise Exception(f"Unknown traversal {traversal}, it should be one of {TRAVERSALS}")
+        self.traversal = traversal
+        self.get_points = get_points
+        self.iterator: Iterator = None
+        self.points: List[Tuple] = []
+        self.exhausted = False
+        self.amount = amount() if amount is not None else None
+        self.plan = plan
+        self.name = name
+        if plan is not None:
+            self.exhausted = True
+            self.amount = len(plan)
+
+    def consume(self, index: int):
+        # Consumes the generator until the point with the given index is cached, or it runs out of points
+        if self.iterator is None:
+            self.iterator = iter(self.get_points())
+        while not self.exhausted and len(self.points) <= index:
+            try:
+                self.points.append(next(self.iterator))
+            except StopIteration:
+                self.exhausted = True
+
+    def __len__(self) -> int:
+        if self.amount is None:
+            self.consume(float("inf"))
+            self.amount = len(self.points)
+        return self.amount
+
+    def __getitem__(self, index: int) -> Tuple:
+        if self.plan is not None:
+            return self.plan[index].item()
+        self.consume(index)
+        if index >= len(self.points):
+            raise IndexError(f"The generator provided {len(self.points)} points, but point {index} was requested")
+        return self.points[index]
+
+    def array(self) -> np.ndarray:
+        """
+        :return: every point as a structured array. The fields of points from a generator are named arg0, arg1...
+        """
+        if self.plan is not None:
+            return self.plan
+        self.consume(len(self) - 1)
+        points = self.points[:len(self)]
+        return np.rec.fromrecords(points, names=[f"arg{i}" for i in range(len(points[0]))]).view(np.ndarray) \
+            if points else np.empty(0, dtype=[("arg0", "float64")])
+
+
+class ScanPlan:
+    """
+    Indexed plan of the points of a run. Each configurable instrument provides a PointSource, and the sources are
+    grouped by coupling level, ordered from the slowest level (lowest coupling) to the fastest one. The index of a
+    point maps to the indices of each level like the digits of a mixed radix number, so the amount of points, random
+    access and slicing are O(1) on the amount of points.
+
+    The index of a point is its position in the execution order. The traversal of each level changes which point of
+    the level is visited at each step, and the logical index of a point (its position in raster order) is given by
+    the method index, so the data can be placed in its cell regardless of the order.
+    """
+
+    def __init__(self, levels: List[List[PointSource]]):
+        self.levels = levels
+        # Coupled sources should have the same amount of points, if they don't we use the shortest one
+        self.shape = tuple(min(len(source) for source in level) for level in levels)
+        self.size = int(np.prod(self.shape, dtype=np.int64)) if self.shape else 0
+        # Amount of points of each pass over a level, the product of the amounts of the faster levels
+        self.strides = [int(np.prod(self.shape[level + 1:], dtype=np.int64)) for level in range(len(self.shape))]
+
+        # The traversal of a level is the one of its sources that isn't raster, if any
+        self.traversals = [next((source.traversal for source in level if source.traversal != "raster"), "raster")
+                           for level in levels]
+        self.orders: List[np.ndarray] = [
+            nearest_order(self.coordinates(level)) if traversal == "nearest" else None
+            for level, traversal in enumerate(self.traversals)
+        ]
+        # The progressive levels are refined together, so their order is a permutation of their points
+        self.progressive = [level for level, traversal in enumerate(self.traversals) if traversal == "progressive"]
+        self.refinement = progressive_order(tuple(self.shape[level] for level in self.progressive)) \
+            if self.progressive else None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def coordinates(self, level: int) -> np.ndarray:
+        # The points of the coupled sources of a level, as an array of shape (points, dimensions)
+        columns = []
+        for source in self.levels[level]:
+            array = source.array()[:self.shape[level]]
+            for name in array.dtype.names:
+                if not np.issubdtype(array.dtype.fields[name][0], np.number):
+                    raise Exception(f"The nearest traversal needs numeric points, but {source.name} has {name} of "
+                                    f"type {array.dtype.fields[name][0]}")
+                columns.append(array[name].astype("float64"))
+        return np.stack(columns, axis=-1)
+
+    def traverse(self, positions: np.ndarray) -> np.ndarray:
+        """
+        :param positions: array with the positions of points in the execution order.
+        :return: an array of shape (points, levels) with the index of each point in each level.
+        """
+        digits = np.stack(np.unravel_index(positions, self.shape), axis=-1)
+        for level, traversal in enumerate(self.traversals):
+            if traversal == "serpentine":
+                # The passes over the level alternate their direction
+                passes = positions // (self.strides[level] * self.shape[level])
+                digits[:, level] = np.where(passes % 2 == 1, self.shape[level] - 1 - digits[:, level],
+                                            digits[:, level])
+            if self.orders[level] is not None:
+                digits[:, level] = self.orders[level][digits[:, level]]
+        if self.refinement is not None:
+            # The digits of the progressive levels are taken as the step of the refinement over them
+            shape = tuple(self.shape[level] for level in self.progressive)
+            step = np.ravel_multi_index(tuple(digits[:, level] for level in self.progressive), shape)
+            digits[:, self.progressive] = np.stack(np.unravel_index(self.refinement[step], shape), axis=-1)
+        return digits
+
+    def indices(self, index: int) -> Tuple[int, ...]:
+        """
+        :return: the index of the point in each level, from the slowest to the fastest.
+        """
+        if not 0 <= index < self.size:
+            raise IndexError(f"Point {index} is out of a plan of {self.size} points")
+        return tuple(int(digit) for digit in self.traverse(np.array([index]))[0])
+
+    def index(self, indices: Tuple[int, ...]) -> int:
+        """
+        :return: the logical index of the point with the given index on each level, its position in raster order.
+        Without traversals it's the inverse of indices.
+        """
+        return int(np.ravel_multi_index(indices, self.shape))
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[Tuple[int, ...], np.ndarray]:
+        """
+        :return: the level indices of a point, or for a slice an array of shape (points, levels) with them.
+        """
+        if isinstance(item, slice):
+            return self.traverse(np.arange(*item.indices(self.size))) \
+                if self.shape else np.zeros((0, 0), dtype=np.int64)
+        if item < 0:
+            item += self.size
+        return self.indices(item)
+
+    def args(self, level: int, index: int) -> List[Tuple]:
+        """
+        :return: the arguments of each source of the level for the given level index.
+        """
+        return [source[index] for source in self.levels[level]]
+
+    def table(self, item: slice = slice(None)) -> np.ndarray:
+        """
+        Builds the points of the plan without running it, for example to preview a scan.
+
+        :param item: slice of the points to include.
+        :return: a structured array with a row for each point and a field for each argument of each source, named
+        {source name}_{argument}.
+        """
+        indices = self[item]
+        arrays = [[source.array() for source in level] for level in self.levels]
+        fields = [(f"{source.name}_{name}" if source.name else name, array.dtype.fields[name][0])
+                  for level, level_arrays in zip(self.levels, arrays)
+                  for source, array in zip(level, level_arrays) for name in array.dtype.names]
+        result = np.empty(len(indices), dtype=fields)
+        names = iter(result.dtype.names)
+        for level, level_arrays in enumerate(arrays):
+            for array in level_arrays:
+                # Fancy indexing by the level index of each point, so the table is built without a python loop
+                rows = array[indices[:, level]]
+                for name in array.dtype.names:
+                    result[next(names)] = rows[name]
+        return result
+
+    def split(self, parts: int) -> List[Tuple[int, int]]:
+        """
+        :return: the (start, stop) positions of parts consecutive chunks of the plan, with similar sizes.
+        """
+        bounds = np.linspace(0, self.size, parts + 1).astype(np.int64)
+        return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
@@ -1,14 +1,47 @@
-from datetime import datetime
+from concurrent.futures import CancelledError
+from inspect import isgeneratorfunction, isasyncgenfunction, iscoroutinefunction
+from time import perf_counter, perf_counter_ns, time_ns
 from traceback import format_exc
-from typing import Collection, Callable
+from typing import Collection, Callable, Tuple, Dict, Any, List, Union, Sequence, Optional
 
+import numpy as np
 from lantz.core.log import get_logger
 from pimpmyclass.mixins import LogMixin
 
-from .data_repository import DataRepository
-from ..interfaces import ComponentInitialization
-from .dispatcher import Dispatcher
+from .criteria import StopCriterion
+from .data_repository import DataRepository, PointRecord
+from ..interfaces import ComponentInitialization, StreamingInstrument, SettleDeadline, ConfigurableInstrument
+from ..interfaces.adaptive import AdaptivePlan
+from .dispatcher import Dispatcher, Phase
 from .gen import MetaArgTracker
+from .plan import PointSource
+from .stream import StreamCapture
+
+
+def point_amount(instrument: ConfigurableInstrument) -> Optional[Callable[[], int]]:
+    """
+    :return: the point_amount method of the instrument if it implements it, so the scan plan doesn't need to run the
+    generator to count the points.
+    """
+    if type(instrument).point_amount is ConfigurableInstrument.point_amount:
+        return None
+    return instrument.point_amount
+
+
+def has_plan(instrument: ConfigurableInstrument) -> bool:
+    return type(instrument).get_plan is not ConfigurableInstrument.get_plan
+
+
+def split_batch(name: str, result: Union[List[Dict[str, Any]], Dict[str, Sequence]], amount: int) \
+        -> List[Dict[str, Any]]:
+    """
+    Converts the result of configure_batch/observe_batch into a dictionary for each point.
+    """
+    if isinstance(result, dict):
+        result = [{k: v[i] for k, v in result.items()} for i in range(amount)]
+    if len(result) != amount:
+        raise Exception(f"{name} returned {len(result)} points for a batch of {amount}")
+    return list(result)
 
 
 class ExperimentRunner(LogMixin):
@@ -18,20 +51,39 @@ class ExperimentRunner(LogMixin):
             self,
             configurable_components: Collection[ComponentInitialization],
             observable_components: Collection[ComponentInitialization],
-            data: DataRepository
+            data: DataRepository,
+            criteria: Collection[StopCriterion] = ()
     ):
         self.logger = get_logger("SER.Core.ExperimentRunner")
         self.observe_comp = observable_components
         self.conf_comp = configurable_components
         self.data = data
         self.error = None
+        self.points_run = 0
+        self.completed = 0  # Amount of points of the current run that are finished, the position to resume from
+        self.criteria = list(criteria)
+        self.criterion: StopCriterion = None  # The criterion that ended the current run, if any
+        self.anchor = (time_ns(), perf_counter_ns())  # The wall clock and perf_counter_ns at the start of the run
+
+        # Streaming observers are read in the background during the run instead of being called on each point
+        self.stream_comp = [comp for comp in observable_components
+                            if isinstance(comp.component.instrument, StreamingInstrument)]
+        self.point_comp = [comp for comp in observable_components if comp not in self.stream_comp]
+        self.streams: Dict[str, StreamCapture] = {}
+
+        # The storage of the array observations is preallocated with their declared shape
+        for comp in observable_components:
+            for variable, (shape, dtype) in comp.component.instrument.observe_arrays.items():
+                self.data.declare_array(comp.name, variable, shape, dtype)
 
         # We create an instance of the dispatcher:
         self.dispatcher = Dispatcher()
+        self.dispatcher.set_dependencies({
+            comp.name: comp.depends_on for comp in [*configurable_components, *observable_components]
+        })
 
     def wrap_fun(self, name, fun):
-        wrapped_fun = lambda *args: self.data.add_datum(name, fun(*args))
-        return self.dispatcher.wrap(wrapped_fun)
+        return self.dispatcher.wrap(fun, name)
 
     def setup_arg_tracker(self):
 
@@ -40,54 +92,283 @@ class ExperimentRunner(LogMixin):
         generators = [
             (
                 comp.component.instrument.coupling,
-                comp.component.instrument.get_points,
+                self.point_source(comp),
                 self.wrap_fun(comp.name, comp.component.instrument.configure)
             )
             for comp in self.conf_comp
         ]
 
         self.arg_tracker = MetaArgTracker(generators)
+        self.completed = 0
+
+    def point_source(self, comp: ComponentInitialization) -> Union[PointSource, AdaptivePlan]:
+        instrument = comp.component.instrument
+        if has_plan(instrument):
+            return PointSource(plan=instrument.get_plan(), name=comp.name, traversal=instrument.traversal)
+        get_points = self.dispatcher.points(instrument.get_points)
+        if not any(check(instrument.get_points)
+                   for check in (isgeneratorfunction, isasyncgenfunction, iscoroutinefunction)):
+            # A plain method may return an adaptive plan instead of the points
+            points = instrument.get_points()
+            if isinstance(points, AdaptivePlan):
+                return points
+            get_points = lambda: points
+        return PointSource(get_points, point_amount(instrument), name=comp.name, traversal=instrument.traversal)
+
+    def seek(self, position: int):
+        """
+        Makes the run start from the given point, skipping the previous ones. Call it after setup_arg_tracker.
+        """
+        self.arg_tracker.seek(position)
+        self.completed = position
 
     def point_amount(self) -> int:
         # This function should always be called after setup_arg_tracker
-        # TODO: rethink if we should grab the lenght of the generators in the metargtracker with a function
         return self.arg_tracker.points_amount()
 
+    def can_overlap(self, names: Collection[str]) -> bool:
+        """
+        :return: if the configuration of the given components can start while the observers are still measuring.
+        """
+        return all(comp.insensitive_to.issuperset(names) for comp in self.observe_comp)
+
+    def configure(self) -> Tuple[PointRecord, Phase, int]:
+        """
+        Starts the configuration of a new point with the tasks queued by the arg tracker.
+
+        :return: the record reserved for the point, the phase and the perf_counter_ns time it was started.
+        """
+        record = self.data.reserve(self.arg_tracker.logical_index())
+        # The point starts before its calls, which may start as soon as they're submitted
+        start = perf_counter_ns()
+        return record, self.dispatcher.submit(), start
+
+    def epoch_ns(self, counter: int) -> int:
+        """
+        :return: the perf_counter_ns time as nanoseconds since the epoch, through the anchor of the run. Unlike the
+        wall clock, the times of a run are monotonic.
+        """
+        return self.anchor[0] + counter - self.anchor[1]
+
+    def timestamp(self, config_start: int, observe_start: int, end: int, *phases: Phase) -> Dict[str, int]:
+        """
+        :return: the times of the point and the start and end of the call of each instrument, in nanoseconds since
+        the epoch. The DataRepository exports them as datetimes.
+        """
+        timestamp = {
+            "config_start_time": self.epoch_ns(config_start),
+            "observe_start_time": self.epoch_ns(observe_start),
+            "end_time": self.epoch_ns(end),
+        }
+        for phase in phases:
+            for name, (start, stop) in phase.timings.items():
+                timestamp[f"{name}_start"] = self.epoch_ns(start)
+                timestamp[f"{name}_end"] = self.epoch_ns(stop)
+        return timestamp
+
+    @staticmethod
+    def store(record: PointRecord, results: Collection[Tuple[str, Dict[str, Any]]]):
+        for name, datum in results:
+            if isinstance(datum, SettleDeadline):
+                datum = datum.datum
+            record.add_datum(name, datum)
+
+    def batch_size(self) -> int:
+        """
+        :return: the amount of points of each chunk of the scan, or 0 if some instrument doesn't support batches.
+        """
+        if self.arg_tracker.adaptive is not None:
+            # The points of an adaptive plan depend on each observation, so they can't be loaded in chunks
+            return 0
+        sizes = [comp.component.instrument.batch_size for comp in [*self.conf_comp, *self.point_comp]]
+        return min(sizes) if sizes else 0
+
     def run_experiment(self, point_callback: Callable = None):
         # Precondition, call setup_arg_tracker
         self.log_info("Starting Experiment Run")
         self.stopped = False
+        self.criterion = None
+        # The wall clock is only read once per run, the times of the points are measured with perf_counter_ns
+        self.anchor = (time_ns(), perf_counter_ns())
+        for criterion in self.criteria:
+            criterion.start_run()
+        self.dispatcher.tasks.clear()
 
-        # Main experimental loop
         try:
-            while not self.stopped and self.arg_tracker.advance():
-                self.log_debug("Advanced Generator")
-                self.data.next()
-                config_time_start = datetime.now()
-                self.dispatcher.execute()
-                self.log_debug("Executed Configurator Dispatch")
-                observe_time_start = datetime.now()
-
-                for comp in self.observe_comp:
-                    self.wrap_fun(comp.name, comp.component.instrument.observe)()
-
-                self.dispatcher.execute()
-                self.log_debug("Executed Observer Dispatch")
-
-                self.data.add_datum("timestamp", {
-                    "config_start_time": config_time_start,
-                    "observe_start_time": observe_time_start,
-                    "end_time": datetime.now()
-                })
-                self.log_debug("Added datum")
-
-                if point_callback:
-                    point_callback()
-                self.log_debug("Advanced one iteration")
+            self.start_streams()
+            batch_size = self.batch_size()
+            if batch_size > 0:
+                self.log_info(f"Running in batches of {batch_size} points")
+                self.run_batches(batch_size, point_callback)
+            else:
+                self.run_points(point_callback)
+        except CancelledError:
+            self.log_info(f"Run stopped {self.dispatcher.stop_latency() * 1000:.1f} ms after cancelling it")
         except Exception as e:
             self.log_error(f"There has been an exception! {format_exc()}")
             self.error = e
+        finally:
+            self.stop_streams()
 
         self.stopped = True
 
         self.log_info("Ending Experiment Run")
+
+    def check_criteria(self, index: int):
+        """
+        Evaluates the stop criteria with the data of the finished point, ending the run if one of them is met.
+        """
+        if self.criterion is not None:
+            return
+        datum = self.data.get_datum_index(index)
+        for criterion in self.criteria:
+            if criterion.check(datum):
+                self.log_info(f"Ending the run as {criterion.reason()}")
+                self.criterion = criterion
+                self.stopped = True
+                return
+
+    def start_streams(self):
+        for comp in self.stream_comp:
+            self.streams[comp.name] = StreamCapture(comp.name, comp.component.instrument)
+            self.streams[comp.name].start()
+
+    def stop_streams(self):
+        for stream in self.streams.values():
+            stream.stop()
+        self.streams.clear()
+
+    def stream_data(self, start_time: float, end_time: float, amount: int = 1) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Reads the samples of each streaming observer between both perf_counter times.
+
+        :param amount: amount of points in which the samples are split, in equal parts.
+        :return: a dictionary of the streaming component names and their data for each point.
+        """
+        result = {}
+        for comp in self.stream_comp:
+            samples = self.streams[comp.name].slice(start_time, end_time)
+            result[comp.name] = [comp.component.instrument.summarize(part)
+                                 for part in np.array_split(samples, amount)]
+        return result
+
+    def run_points(self, point_callback: Callable = None):
+        # Main experimental loop
+        # The configuration of the next point is kept in pending, as it can start before the current point ends
+        pending = None
+        if self.arg_tracker.advance():
+            pending = self.configure()
+        previous_end = 0.0  # The perf_counter time at which the previous point ended
+
+        while pending is not None:
+            self.log_debug("Advanced Generator")
+            record, configuring, config_start = pending
+            pending = None
+            if self.stopped:
+                # The run was stopped while this point was being configured ahead, so it's discarded
+                self.dispatcher.collect(configuring)
+                break
+            configured = self.dispatcher.collect(configuring)
+            self.store(record, configured)
+            self.dispatcher.settle(configured)
+            self.log_debug("Executed Configurator Dispatch")
+            observe_start = perf_counter_ns()
+
+            for comp in self.point_comp:
+                self.dispatcher.add_task(comp.name, comp.component.instrument.observe, ())
+            observing = self.dispatcher.submit()
+
+            # While observing we advance to the next point, and configure it right away if the observers allow it.
+            # An adaptive plan needs the observation of the point to choose the next one, so it advances after it.
+            has_next = None
+            if self.arg_tracker.adaptive is None:
+                has_next = not self.stopped and self.arg_tracker.advance()
+                if has_next and self.can_overlap([name for name, _, _ in self.dispatcher.tasks]):
+                    pending = self.configure()
+                    self.log_debug("Started pipelined configuration")
+
+            self.store(record, self.dispatcher.collect(observing))
+            # A point configured ahead starts before the previous one ends, the samples until then are of the previous
+            end = perf_counter()
+            for name, data in self.stream_data(max(config_start / 1e9, previous_end), end).items():
+                record.add_datum(name, data[0])
+            previous_end = end
+            self.log_debug("Executed Observer Dispatch")
+
+            record.add_datum("timestamp", self.timestamp(config_start, observe_start, perf_counter_ns(), configuring,
+                                                         observing))
+            # The point becomes visible to the interface and the exports with all its data at once
+            index = self.data.publish(record)
+            self.arg_tracker.record(self.data.get_datum_index(index))
+            self.check_criteria(index)
+            self.log_debug("Added datum")
+
+            self.points_run += 1
+            self.completed += 1
+            if point_callback:
+                point_callback()
+            self.log_debug("Advanced one iteration")
+
+            if has_next is None:
+                has_next = not self.stopped and self.arg_tracker.advance()
+            if has_next and pending is None and not self.stopped:
+                pending = self.configure()
+
+    def run_batches(self, batch_size: int, point_callback: Callable = None):
+        # Batch loop, each instrument receives a whole chunk of the scan in a single call
+        current_args: Dict[str, Tuple] = {}
+        while not self.stopped:
+            # We collect the arguments of the chunk from the tasks the arg tracker queues on each point
+            changed: List[List[Tuple[str, Tuple]]] = []
+            logical: List[int] = []
+            args: Dict[str, List[Tuple]] = {comp.name: [] for comp in self.conf_comp}
+            while len(changed) < batch_size and self.arg_tracker.advance():
+                changed.append([(name, arguments) for name, _, arguments in self.dispatcher.tasks])
+                logical.append(self.arg_tracker.logical_index())
+                self.dispatcher.tasks.clear()
+                current_args.update(changed[-1])
+                for name in args:
+                    args[name].append(current_args[name])
+            amount = len(changed)
+            if amount == 0:
+                break
+
+            config_start = perf_counter_ns()
+            for comp in self.conf_comp:
+                self.dispatcher.add_task(comp.name, comp.component.instrument.configure_batch, (args[comp.name],))
+            configuring = self.dispatcher.submit()
+            collected = self.dispatcher.collect(configuring)
+            configured = {name: split_batch(name, result.datum if isinstance(result, SettleDeadline) else result,
+                                            amount)
+                          for name, result in collected}
+            # A whole batch or each of its points can have a SettleDeadline, the batch is observed after the latest
+            self.dispatcher.settle([*collected, *[(name, x) for name, data in configured.items() for x in data]])
+            self.log_debug("Executed Configurator Batch")
+
+            observe_start = perf_counter_ns()
+            for comp in self.point_comp:
+                self.dispatcher.add_task(comp.name, comp.component.instrument.observe_batch, (amount,))
+            observing = self.dispatcher.submit()
+            observed = {name: split_batch(name, result, amount)
+                        for name, result in self.dispatcher.collect(observing)}
+            observed.update(self.stream_data(config_start / 1e9, perf_counter(), amount))
+            self.log_debug("Executed Observer Batch")
+
+            # Every point of the batch gets the times of the whole batch, as the instruments only report them per call
+            timestamp = self.timestamp(config_start, observe_start, perf_counter_ns(), configuring, observing)
+            for i in range(amount):
+                record = self.data.reserve(logical[i])
+                # As in the point by point loop, configuration data is only added when the instrument was configured
+                self.store(record, [(name, configured[name][i]) for name, _ in changed[i]])
+                self.store(record, [(name, values[i]) for name, values in observed.items()])
+                record.add_datum("timestamp", dict(timestamp))
+                index = self.data.publish(record)
+                self.check_criteria(index)
+                self.points_run += 1
+                self.completed += 1
+                if point_callback:
+                    point_callback()
+                if self.stopped:
+                    # The rest of the batch was measured, but the run ends at the point that met the criterion
+                    break
+            self.log_debug(f"Added {amount} points")
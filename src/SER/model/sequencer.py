@@ -1,10 +1,14 @@
 from cProfile import runctx
-from typing import Callable, Collection, Any
+from traceback import format_exc
+from typing import Callable, Collection, Any, Tuple, List
 from logging import getLogger as get_logger
 
 from pimpmyclass.mixins import LogMixin
 
+from .checkpoint import Checkpointer
+from .criteria import StopCriterion
 from .data_repository import DataRepository
+from .writer import DataWriter
 from .runner import ExperimentRunner
 from ..interfaces import Instrument, ComponentInitialization
 
@@ -18,11 +22,34 @@ class ExperimentSequencer(LogMixin):
     def __init__(
             self,
             configurable_components: Collection[ComponentInitialization],
-            observable_components: Collection[ComponentInitialization]
+            observable_components: Collection[ComponentInitialization],
+            checkpointer: Checkpointer = None,
+            stop_criteria: Collection[StopCriterion] = (),
+            writer: DataWriter = None,
+            memory_budget: int = None,
+            spill_folder: str = None,
+            trace_memory: bool = False,
+            arrays_on_disk: bool = False
     ):
+        """
+        :param configurable_components: List of ComponentInitialization that include ConfigurableInstrument
+        :param observable_components: List of ComponentInitialization that include ObservableInstrument
+        :param checkpointer: If provided, the position of the sequence and its data are saved periodically, so it can
+        be resumed with resume_sequence.
+        :param stop_criteria: Conditions evaluated after each point that end the run, moving on to the next one.
+        :param writer: If provided, the finished points are written to disk during the sequence.
+        :param memory_budget: Maximum amount of bytes of data kept in memory, the oldest points are spilled to
+        spill_folder once it's exceeded. If None, every point is kept in memory.
+        :param spill_folder: Folder where the spilled points are written, a temporary folder if None.
+        :param trace_memory: If True, the memory of each run is traced with tracemalloc and reported at the end.
+        :param arrays_on_disk: If True, the array observations are stored in memory mapped files in spill_folder.
+        """
         self.sequence = []
-        self.data = DataRepository()
-        self.runner = ExperimentRunner(configurable_components, observable_components, self.data)
+        self.checkpointer = checkpointer
+        self.run_index = 0
+        self.data = DataRepository(memory_budget, spill_folder, trace_memory, arrays_on_disk)
+        self.data.writer = writer
+        self.runner = ExperimentRunner(configurable_components, observable_components, self.data, stop_criteria)
 
         self.components = {}
         for comp in configurable_components:
@@ -37,8 +64,12 @@ class ExperimentSequencer(LogMixin):
         self.stopped = True
         self.runner.stopped = True
         if premature:
-            for instrument in self.components.values():
-                instrument.stop()
+            # The point in progress is abandoned, so the stop takes effect without waiting for the instruments
+            self.runner.dispatcher.cancel()
+            for name, instrument in self.components.items():
+                # The copy of a process instrument that is measuring lives in its worker process
+                if not self.runner.dispatcher.request_stop(name):
+                    instrument.stop()
 
     def add_run(self):
         new_run = {}
@@ -51,37 +82,142 @@ class ExperimentSequencer(LogMixin):
     def load_sequence(self, sequence):
         self.sequence = sequence
 
-    def start_sequence(self, run_callback: Callable[[], Any], point_callback: Callable):
+    def load_checkpoint(self, filename: str) -> Tuple[int, int]:
+        """
+        Loads the sequence and the data saved in a checkpoint.
+
+        :return: the index of the run and the point from which the sequence has to continue.
+        """
+        state = Checkpointer.load(filename)
+        self.sequence = state["sequence"]
+        self.data.restore(state["data"])
+        self.log_info(f"Loaded checkpoint at run {state['run']}, point {state['position']}")
+        return state["run"], state["position"]
+
+    def resume_sequence(self, filename: str, run_callback: Callable[[], Any], point_callback: Callable):
+        """
+        Continues the sequence saved in the checkpoint from the next unmeasured point.
+        """
+        return self.start_sequence(run_callback, point_callback, *self.load_checkpoint(filename))
+
+    def checkpoint(self, run: int, position: int, background: bool = False):
+        """
+        Saves the position of the sequence and its data.
+
+        :param background: if True, the checkpoint is written on a background thread, and skipped if the previous
+        one is still being written. Otherwise, it's written before returning.
+        """
+        if self.checkpointer is not None:
+            state = {
+                "sequence": self.sequence,
+                "run": run,
+                "position": position,
+                "complete": run >= len(self.sequence),
+                "data": self.data.state(),
+            }
+            if background:
+                self.checkpointer.save_in_background(state)
+            else:
+                self.checkpointer.wait()
+                self.checkpointer.save(state)
+
+    def local_instruments(self) -> List[Instrument]:
+        # An instrument with the process backend is initialized and finalized by its worker process, which holds the
+        # copy that talks to the hardware, so the one in this process never opens its connection
+        return [comp.component.instrument for comp in [*self.runner.conf_comp, *self.runner.observe_comp]
+                if comp.component.instrument.execution_backend != "process"]
+
+    def point_done(self, point_callback: Callable):
+        if self.checkpointer is not None and self.checkpointer.due():
+            # The points keep being measured while it's written
+            self.checkpoint(self.run_index, self.runner.completed, background=True)
+        if point_callback:
+            point_callback()
+
+    def start_sequence(self, run_callback: Callable[[], Any], point_callback: Callable, start_run: int = 0,
+                       start_position: int = 0):
+        """
+        Executes each run of the sequence.
+
+        :param run_callback: Called at the start of each run.
+        :param point_callback: Called after each point.
+        :param start_run: Index of the run from which to start, the previous runs are skipped.
+        :param start_position: Point of the first run from which to start.
+        :return: the exception that ended the sequence, if any.
+        """
         # TODO: mention the initialize in documentation
         # We initialize every component
-        for conf in self.runner.conf_comp:
-            conf.component.instrument.initialize()
-        for observe in self.runner.observe_comp:
-            observe.component.instrument.initialize()
-
-        self.stopped = False
-
-        for run in self.sequence:
-            for comp, conf in run.items():
-                self.components[comp].set_config(conf)
-            self.runner.setup_arg_tracker()
-            if run_callback:
-                run_callback()
-
-            self.runner.run_experiment(point_callback)
-            # If we have an error we stop the run and alert the user in the
-            if self.runner.error is not None:
-                break
-            self.data.next_run()
-            if self.stopped:
-                break
-
-        self.stopped = True
-
-        # We finalize every component
-        for conf in self.runner.conf_comp:
-            conf.component.instrument.finalize()
-        for observe in self.runner.observe_comp:
-            observe.component.instrument.finalize()
+        for instrument in self.local_instruments():
+            instrument.initialize()
+
+        # From here on the workers, the writer and the instruments are always shut down, even if a step fails
+        try:
+            self.stopped = False
+            for criterion in self.runner.criteria:
+                criterion.start_sequence()
+
+            # Each instrument gets a worker thread that lasts for the whole sequence
+            self.runner.points_run = 0
+            self.runner.dispatcher.start(self.components)
+            if self.data.writer is not None:
+                self.data.writer.start()
+
+            for run_index, run in enumerate(self.sequence):
+                if run_index < start_run:
+                    continue
+                self.run_index = run_index
+                for comp, conf in run.items():
+                    self.components[comp].set_config(conf)
+                self.runner.dispatcher.start_run()
+                self.runner.setup_arg_tracker()
+                if run_index == start_run and start_position:
+                    self.runner.seek(start_position)
+                if run_callback:
+                    run_callback()
+
+                self.runner.run_experiment(lambda: self.point_done(point_callback))
+                # If we have an error we stop the run and alert the user in the
+                # A run ended by a stop criterion is complete, so the sequence moves on to the next one
+                if self.runner.error is not None or \
+                        (not self.runner.arg_tracker.stopped and self.runner.criterion is None):
+                    self.checkpoint(run_index, self.runner.completed)
+                    if self.runner.error is not None:
+                        break
+                else:
+                    self.data.next_run()
+                    self.checkpoint(run_index + 1, 0)
+                if self.stopped or (self.runner.criterion is not None and self.runner.criterion.ends_sequence):
+                    break
+        except Exception as e:
+            self.log_error(f"The sequence could not continue! {format_exc()}")
+            self.runner.error = e
+        finally:
+            self.stopped = True
+            self.runner.dispatcher.shutdown()
+            if self.data.writer is not None:
+                self.data.writer.stop()
+            if self.checkpointer is not None:
+                self.checkpointer.wait()
+            self.log_overhead()
+            self.log_memory()
+
+            # We finalize every component
+            for instrument in self.local_instruments():
+                instrument.finalize()
 
         return self.runner.error
+
+    def log_overhead(self):
+        report = self.runner.dispatcher.report()
+        if self.runner.points_run and report["pool_startup_per_phase"]:
+            saved = report["saved"] / self.runner.points_run
+            self.log_info(f"Persistent workers saved {saved * 1e6:.1f} us per point "
+                          f"({report['saved']:.3f} s over {self.runner.points_run} points)")
+
+    def log_memory(self):
+        stats = self.data.memory_stats()
+        self.log_info(f"The data uses {stats['resident_bytes'] / 2 ** 20:.1f} MiB of memory for "
+                      f"{stats['resident_points']} points, {stats['spilled_points']} points were spilled to "
+                      f"{stats['chunks']} chunks ({stats['spilled_bytes'] / 2 ** 20:.1f} MiB)")
+        if "run_peaks" in stats:
+            self.log_info(f"Peak traced memory of each run: {stats['run_peaks']}")
@@ -0,0 +1,126 @@
+from threading import Thread, Lock
+from time import perf_counter
+from traceback import format_exc
+
+import numpy as np
+from lantz.core.log import get_logger
+from pimpmyclass.mixins import LogMixin
+
+from ..interfaces import StreamingInstrument
+
+
+class RingBuffer:
+    """
+    Preallocated circular buffer of samples, each one tagged with the perf_counter time at which it was taken.
+    It has a single writer (the capture thread) and it can be read from any thread.
+    """
+
+    def __init__(self, capacity: int, channels: int = 1, dtype="float64"):
+        self.capacity = capacity
+        self.samples = np.zeros((capacity, channels), dtype=dtype)
+        self.times = np.zeros(capacity, dtype="float64")
+        self.written = 0  # Total amount of samples written, the next sample goes to written % capacity
+        self.lock = Lock()
+
+    def write(self, block: np.ndarray, end_time: float, rate: float = None):
+        """
+        Writes a block of samples. If the rate is known the samples are timed backwards from end_time, otherwise
+        all the samples of the block get end_time.
+
+        :param block: array of shape (samples,) or (samples, channels).
+        :param end_time: perf_counter time of the last sample of the block.
+        :param rate: sampling rate in Hz.
+        """
+        # A poll without data, or a read after stop_stream, can give an empty block
+        if len(block) == 0:
+            return
+        block = np.asarray(block).reshape(len(block), -1)[-self.capacity:]
+        amount = len(block)
+        if rate:
+            times = end_time - np.arange(amount - 1, -1, -1) / rate
+        else:
+            times = np.full(amount, end_time)
+
+        with self.lock:
+            start = self.written % self.capacity
+            first = min(amount, self.capacity - start)
+            self.samples[start:start + first] = block[:first]
+            self.times[start:start + first] = times[:first]
+            self.samples[:amount - first] = block[first:]
+            self.times[:amount - first] = times[first:]
+            self.written += amount
+
+    def segments(self):
+        # The valid samples in chronological order, as up to two slices of the arrays
+        end = self.written % self.capacity
+        if self.written <= self.capacity:
+            return [slice(0, self.written)]
+        return [slice(end, self.capacity), slice(0, end)]
+
+    def between(self, start_time: float, end_time: float) -> np.ndarray:
+        """
+        :return: a copy of the samples taken after start_time and up to end_time, as an array of shape
+        (samples, channels). Consecutive intervals don't share samples.
+        """
+        with self.lock:
+            parts = []
+            for segment in self.segments():
+                times = self.times[segment]
+                first = np.searchsorted(times, start_time, side="right")
+                last = np.searchsorted(times, end_time, side="right")
+                parts.append(self.samples[segment][first:last])
+            return np.concatenate(parts) if parts else self.samples[:0].copy()
+
+    def oldest(self) -> float:
+        """
+        :return: the time of the oldest sample still available, samples before it were overwritten.
+        """
+        with self.lock:
+            if self.written == 0:
+                return float("inf")
+            return self.times[self.segments()[0].start]
+
+
+class StreamCapture(LogMixin):
+    """
+    Background thread that reads the stream of a StreamingInstrument into a RingBuffer during a run.
+    """
+
+    def __init__(self, name: str, instrument: StreamingInstrument):
+        self.logger = get_logger("SER.Core.StreamCapture")
+        self.name = name
+        self.instrument = instrument
+        self.buffer = RingBuffer(instrument.stream_capacity, instrument.stream_channels, instrument.stream_dtype)
+        self.running = False
+        self.error = None
+        self.thread = Thread(target=self.capture, name=f"SER-Stream-{name}", daemon=True)
+
+    def start(self):
+        self.running = True
+        self.instrument.start_stream()
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.instrument.stop_stream()
+        if self.thread.is_alive():
+            self.thread.join(timeout=1)
+
+    def capture(self):
+        try:
+            while self.running:
+                block = self.instrument.read_stream()
+                self.buffer.write(block, perf_counter(), self.instrument.stream_rate)
+        except Exception as e:
+            self.log_error(f"The stream of {self.name} stopped with an exception! {format_exc()}")
+            self.error = e
+
+    def slice(self, start_time: float, end_time: float) -> np.ndarray:
+        """
+        :return: the samples captured between both perf_counter times.
+        """
+        if self.error is not None:
+            raise self.error
+        if self.buffer.written > self.buffer.capacity and self.buffer.oldest() > start_time:
+            self.log_warning(f"The ring buffer of {self.name} is too small, samples of the point were overwritten")
+        return self.buffer.between(start_time, end_time)
@@ -0,0 +1,151 @@
+"""
+Shared memory transport of the arrays returned by the instruments with the "process" execution backend. Each of them
+gets a ring buffer in shared memory, where its worker process writes the large arrays of the results of configure and
+observe, so only a small SharedArray handle is pickled through the pipe. The DataRepository copies the array from the
+ring straight into its column and releases the handle.
+"""
+from multiprocessing.shared_memory import SharedMemory
+from typing import Tuple, Dict, Any, Optional
+
+import numpy as np
+
+SHARED_MINIMUM = 64 * 2 ** 10  # Smaller arrays are cheaper to pickle than to go through the ring
+HEADER_BYTES = 64  # The head, tail and capacity of the ring, in their own cache line
+ALIGNMENT = 64
+
+# The rings attached in this process by name, used to resolve the handles
+rings: Dict[str, "SharedRing"] = {}
+
+
+class SharedArray:
+    """
+    Handle of an array written in a SharedRing. The array stays valid until the handle, or a handle written after it,
+    is released.
+    """
+    __slots__ = ("ring", "offset", "shape", "dtype", "end")
+
+    def __init__(self, ring: str, offset: int, shape: Tuple[int, ...], dtype: np.dtype, end: int):
+        """
+        :param ring: the name of the shared memory of the ring.
+        :param offset: position of the array in the buffer of the ring.
+        :param end: position of the ring after the array, the tail moves there when it's released.
+        """
+        self.ring = ring
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, index: int) -> "SharedArray":
+        # A row of a stacked array, as observe_batch can return the arrays of every point of the batch in one
+        if not 0 <= index < self.shape[0]:
+            raise IndexError(f"Index {index} is out of bounds for a shared array of shape {self.shape}")
+        row_bytes = int(np.prod(self.shape[1:])) * self.dtype.itemsize
+        return SharedArray(self.ring, self.offset + index * row_bytes, self.shape[1:], self.dtype, self.end)
+
+    def array(self) -> np.ndarray:
+        """
+        :return: a view of the array in the shared memory, it must be copied before the handle is released.
+        """
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=rings[self.ring].memory.buf,
+                          offset=HEADER_BYTES + self.offset)
+
+    def release(self):
+        ring = rings.get(self.ring)
+        if ring is not None:
+            ring.release(self.end)
+
+
+class SharedRing:
+    """
+    Ring buffer in shared memory with a single writer, the worker process, and a single reader, the main process.
+    The writer moves the head after writing each array and the reader moves the tail when it releases them, in the
+    order they were written. The positions only grow, and their remainder by the capacity is the place in the buffer.
+    When the ring is full, write returns None and the array is pickled as usual.
+    """
+
+    def __init__(self, memory: SharedMemory, owner: bool):
+        """
+        :param owner: if this process created the shared memory, which is then removed by close.
+        """
+        self.memory = memory
+        self.owner = owner
+        self.positions = np.ndarray(3, dtype=np.int64, buffer=memory.buf)  # head, tail and capacity
+        self.capacity = int(self.positions[2])
+        rings[memory.name] = self
+
+    @classmethod
+    def create(cls, capacity: int) -> "SharedRing":
+        memory = SharedMemory(create=True, size=HEADER_BYTES + capacity)
+        np.ndarray(3, dtype=np.int64, buffer=memory.buf)[:] = (0, 0, capacity)
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedRing":
+        # The worker processes share the resource tracker of the main process, which removes the memory with close
+        return cls(SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def write(self, array: np.ndarray) -> Optional[SharedArray]:
+        """
+        :return: the handle of the copy of the array in the ring, or None if it doesn't have room for it.
+        """
+        size = -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        head, tail = int(self.positions[0]), int(self.positions[1])
+        start = head
+        if start % self.capacity + size > self.capacity:
+            # The arrays are contiguous, so the rest of the buffer is skipped
+            start += self.capacity - start % self.capacity
+        if start + size - tail > self.capacity:
+            return None
+        offset = start % self.capacity
+        np.ndarray(array.shape, dtype=array.dtype, buffer=self.memory.buf, offset=HEADER_BYTES + offset)[...] = array
+        self.positions[0] = start + size
+        return SharedArray(self.name, offset, array.shape, array.dtype, start + size)
+
+    def release(self, end: int):
+        # Releasing an array also releases the ones written before it
+        if end > self.positions[1]:
+            self.positions[1] = end
+
+    def close(self):
+        rings.pop(self.name, None)
+        self.positions = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # A view of the memory is still alive, the mapping is removed when it's collected
+            pass
+        if self.owner:
+            self.memory.unlink()
+
+
+def share_value(value: Any, ring: SharedRing, dimensions: int) -> Any:
+    if isinstance(value, np.ndarray) and value.ndim >= dimensions and value.dtype.kind in "biufc" and \
+            value.nbytes >= SHARED_MINIMUM:
+        handle = ring.write(value)
+        if handle is not None:
+            return handle
+    return value
+
+
+def share(result: Any, ring: SharedRing, batch: bool = False) -> Any:
+    """
+    Replaces the large arrays of the result of configure or observe, or of their batch versions, by handles of their
+    copies in the ring.
+
+    :param batch: if the result comes from a batch method. The arrays of a dictionary of sequences need a dimension
+    more, as the first one is the point.
+    """
+    if isinstance(result, dict):
+        dimensions = 2 if batch else 1
+        return {key: share_value(value, ring, dimensions) for key, value in result.items()}
+    if batch and isinstance(result, (list, tuple)):
+        return [share(datum, ring) for datum in result]
+    return result
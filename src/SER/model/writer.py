@@ -0,0 +1,234 @@
+import json
+from datetime import datetime
+from glob import glob, escape
+from os import fsync, path, SEEK_END
+from queue import SimpleQueue, Empty
+from threading import Thread, Event
+from traceback import format_exc
+from typing import Dict, Any, List
+
+import numpy as np
+import pandas as pd
+from lantz.core.log import get_logger
+from pimpmyclass.mixins import LogMixin
+
+from .data_repository import TIME_COMPONENT
+
+# Arrow is optional, without it the data is written as JSON lines
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+ARROW_EXTENSIONS = (".arrow", ".arrows")
+
+
+def encode(value: Any) -> Any:
+    # Converts the values JSON doesn't support
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def flatten(datum: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    # The row of a point with a column for each variable, named like the columns of DataRepository.to_dataframe
+    return {f"{name}_{variable}": value for name, variables in datum.items() for variable, value in variables.items()}
+
+
+def convert_times(df: pd.DataFrame) -> pd.DataFrame:
+    # The times are written as nanoseconds since the epoch, like they are stored in the DataRepository
+    for column in df.columns:
+        if column.startswith(f"{TIME_COMPONENT}_") and pd.api.types.is_numeric_dtype(df[column]) and \
+                not pd.api.types.is_bool_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column], unit="ns")
+    return df
+
+
+def part_name(filename: str, part: int) -> str:
+    base, extension = path.splitext(filename)
+    return filename if part == 0 else f"{base}.{part}{extension}"
+
+
+class JsonLinesSink:
+    """
+    Writes each point as a line with a JSON object. A line cut by a crash is skipped when reading.
+    """
+
+    def __init__(self, filename: str):
+        self.file = open(filename, "a", encoding="utf-8")
+        if self.file.tell() > 0:
+            with open(filename, "rb") as file:
+                file.seek(-1, SEEK_END)
+                cut = file.read(1) != b"\n"
+            if cut:
+                # The line cut by a crash is ended, otherwise the first point appended would be lost with it
+                self.file.write("\n")
+
+    def write(self, rows: List[Dict[str, Dict[str, Any]]]):
+        self.file.write("".join(json.dumps(row, default=encode) + "\n" for row in rows))
+        self.file.flush()
+        fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowSink:
+    """
+    Writes the points as record batches of an Arrow IPC stream. As a stream has a single schema, a new part file is
+    started when the variables change. A batch cut by a crash is skipped when reading.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.part = 0
+        while path.exists(part_name(filename, self.part)):
+            self.part += 1
+        self.file = None
+        self.writer = None
+        self.schema = None
+
+    def write(self, rows: List[Dict[str, Dict[str, Any]]]):
+        # Arrow only converts the 1D arrays to lists, the arrays with more dimensions are written as nested lists
+        rows = [{key: value.tolist() if isinstance(value, np.ndarray) and value.ndim > 1 else value
+                 for key, value in flatten(row).items()} for row in rows]
+        table = None
+        if self.schema is not None:
+            try:
+                # The variables missing from a point, like the ones of instruments that weren't configured, are null
+                if set().union(*rows).issubset(self.schema.names):
+                    table = pa.Table.from_pylist(rows, schema=self.schema)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                pass
+            if table is None:
+                # The variables changed, so we continue in a new part
+                self.close()
+                self.part += 1
+        if table is None:
+            table = pa.Table.from_pylist(rows)
+        if self.writer is None:
+            self.file = pa.OSFile(part_name(self.filename, self.part), "wb")
+            self.writer = pa.ipc.new_stream(self.file, table.schema)
+            self.schema = table.schema
+        self.writer.write_table(table)
+        self.file.flush()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.file.close()
+        self.writer = None
+        self.schema = None
+
+
+class DataWriter(LogMixin):
+    """
+    Append-only writer of the finished points to disk. The points are queued by the DataRepository and written in
+    batches by a background thread every interval seconds, so the data survives a crash of the application. Files
+    with the extension .arrow or .arrows are written as Arrow IPC streams if pyarrow is installed, any other file as
+    JSON lines.
+    """
+
+    def __init__(self, filename: str, interval: float = 1.0):
+        """
+        :param filename: path of the file, the data is appended if it already exists.
+        :param interval: seconds between the writes of each batch.
+        """
+        self.logger = get_logger("SER.Core.DataWriter")
+        self.filename = filename
+        self.interval = interval
+        self.arrow = filename.endswith(ARROW_EXTENSIONS)
+        if self.arrow and pa is None:
+            self.log_warning("pyarrow is not installed, the data will be written as JSON lines")
+            self.arrow = False
+        self.queue = SimpleQueue()
+        self.stopping = Event()
+        self.thread: Thread = None
+        self.sink = None
+        self.written = 0
+        self.error = None
+
+    def start(self):
+        self.sink = ArrowSink(self.filename) if self.arrow else JsonLinesSink(self.filename)
+        self.stopping.clear()
+        self.thread = Thread(target=self.run, name="SER-Writer", daemon=True)
+        self.thread.start()
+
+    def write(self, datum: Dict[str, Dict[str, Any]]):
+        """
+        Queues the data of a finished point.
+        """
+        self.queue.put(datum)
+
+    def stop(self):
+        """
+        Writes the queued points and closes the file.
+        """
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+            self.sink.close()
+            self.log_info(f"Wrote {self.written} points to {self.filename}")
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        rows = []
+        try:
+            while True:
+                rows.append(self.queue.get_nowait())
+        except Empty:
+            pass
+        if rows and self.error is None:
+            try:
+                self.sink.write(rows)
+                self.written += len(rows)
+            except Exception as e:
+                # The run goes on without writing, the data is still in memory
+                self.log_error(f"The data couldn't be written to {self.filename}! {format_exc()}")
+                self.error = e
+
+
+def read_data(filename: str) -> pd.DataFrame:
+    """
+    Reads a file written by a DataWriter, including one left by a crash, in which case the points of the last
+    incomplete batch are lost.
+
+    :return: a DataFrame with a row for each point and a column for each variable, in the order they were written.
+    The times of the points are converted to datetimes.
+    """
+    if filename.endswith(ARROW_EXTENSIONS):
+        base, extension = path.splitext(filename)
+        numbers = [name[len(base) + 1:-len(extension)] for name in glob(f"{escape(base)}.*{extension}")]
+        parts = [filename] + [part_name(filename, int(number)) for number in sorted(
+            (number for number in numbers if number.isdigit()), key=int)]
+        tables = []
+        for part in parts:
+            with pa.OSFile(part, "rb") as file:
+                reader = pa.ipc.open_stream(file)
+                try:
+                    for batch in reader:
+                        tables.append(pa.Table.from_batches([batch]))
+                except (pa.ArrowInvalid, OSError):
+                    pass
+        if not tables:
+            return pd.DataFrame()
+        return convert_times(pd.concat([table.to_pandas() for table in tables], ignore_index=True))
+
+    rows = []
+    with open(filename, encoding="utf-8") as file:
+        for line in file:
+            try:
+                rows.append(flatten(json.loads(line)))
+            except json.JSONDecodeError:
+                pass
+    return convert_times(pd.DataFrame(rows))
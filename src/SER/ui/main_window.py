@@ -18,11 +18,14 @@ from .process_ui_manager import ProcessUIManager
 from .progress_tracker import ProgressTracker
 from ..interfaces import ComponentInitialization, ProcessDataUI, FinalDataUI
 from ..model.documentation import to_md, to_htm
+from ..model.exporter import DataExporter
 from ..model.sequencer import ExperimentSequencer
 
 
 class MainWidget(QWidget, LogMixin):
     sequence_ended = pyqtSignal()
+    export_progress = pyqtSignal(int, int)  # Points exported and total, sent from the thread of the exporter
+    export_ended = pyqtSignal(object)  # The exception that stopped the export, or None
 
     run_list_widget: QListWidget
 
@@ -32,6 +35,7 @@ class MainWidget(QWidget, LogMixin):
 
     start_button: QPushButton
     add_run_button: QPushButton
+    resume_button: QPushButton
     load_conf_button: QPushButton
     configuration_dialog: ComponentsDialog
 
@@ -44,6 +48,8 @@ class MainWidget(QWidget, LogMixin):
     data_save_docs_mkd_button: QPushButton
     data_save_mat_button: QPushButton
     data_save_csv_button: QPushButton
+    data_export_button: QPushButton
+    data_export_progress: QProgressBar
     data_table: QTableView
     data_model: TableModel
 
@@ -74,6 +80,8 @@ class MainWidget(QWidget, LogMixin):
         self.run_thread = Thread(target=self.run_experiment)
         self.error = None  # If we have found an error that forced the run experiment to end, we save the exception here
         self.started = False
+        self.resume_from = (0, 0)  # Run and point from which to start the sequence
+        self.conf_folder = conf_folder
         self.logger = get_logger("SER.Core.MainWindow")
 
         # Loading GUI
@@ -90,7 +98,10 @@ class MainWidget(QWidget, LogMixin):
         self.load_config_gui(conf_folder,  coupling_ui_options)
         self.out_folder = out_folder
 
+        self.exporter: DataExporter = None
         self.sequence_ended.connect(self.sequence_end)
+        self.export_progress.connect(self.show_export_progress)
+        self.export_ended.connect(self.export_end)
 
     def load_config_gui(self, conf_folder: str, coupling_ui_options: dict[str, Any]):
         self.log_debug(msg="Started loading configuration interface")
@@ -107,6 +118,7 @@ class MainWidget(QWidget, LogMixin):
 
         self.start_button.pressed.connect(self.start_experiment)
         self.add_run_button.pressed.connect(self.add_run)
+        self.resume_button.pressed.connect(self.resume_experiment)
         self.stack_widget.setCurrentWidget(self.conf_page)
         self.configuration_dialog = ComponentsDialog(self.progress_manager, self.components, conf_folder)
         self.load_conf_button.pressed.connect(self.configuration_dialog.show)
@@ -115,6 +127,7 @@ class MainWidget(QWidget, LogMixin):
         self.load_conf_button.setText(localizator.get("load_configuration"))
         self.add_run_button.setText(localizator.get("add_run_configuration"))
         self.start_button.setText(localizator.get("start_experiment"))
+        self.resume_button.setText(localizator.get("resume_experiment"))
         self.conf_box.setTitle(localizator.get("configuration"))
 
     def load_run_gui(self):
@@ -143,6 +156,8 @@ class MainWidget(QWidget, LogMixin):
         self.data_save_docs_mkd_button.pressed.connect(self.export_docs_to_md)
         self.data_save_mat_button.pressed.connect(self.export_to_matlab)
         self.data_save_csv_button.pressed.connect(self.export_to_csv)
+        self.data_export_button.pressed.connect(self.export_data)
+        self.data_export_progress.setVisible(False)
         for ui in self.final_data_ui:
             self.data_layout.addWidget(ui, ui.y, ui.x)
             try:
@@ -157,11 +172,34 @@ class MainWidget(QWidget, LogMixin):
         self.data_save_mat_button.setText(localizator.get("save_as_mat"))
         self.data_save_docs_mkd_button.setText(localizator.get("save_as_md"))
         self.data_save_docs_htm_button.setText(localizator.get("save_as_html"))
+        self.data_export_button.setText(localizator.get("export_data"))
 
     def add_run(self):
         run = self.sequencer.add_run()
         self.progress_manager.add_run(run)
 
+    def resume_experiment(self):
+        """
+        Loads a checkpoint and starts the experiment from the next point that wasn't measured.
+        """
+        options = QFileDialog.Options()
+        file_dialog = QFileDialog()
+        file_dialog.setDirectory(self.conf_folder)
+        file_name, _ = file_dialog.getOpenFileName(self, "Open File", "", "All Files (*)", options=options)
+
+        if file_name:
+            try:
+                run, position = self.sequencer.load_checkpoint(file_name)
+            except Exception as e:
+                error_box = QMessageBox()
+                error_box.setText(f"The checkpoint couldn't be loaded:\n{''.join(format_exception_only(e))}")
+                error_box.exec()
+                return
+            self.progress_manager.load_sequence(self.sequencer.sequence)
+            self.progress_manager.resume(run, position)
+            self.resume_from = (run, position)
+            self.start_experiment()
+
     def start_experiment(self):
         """
         This method runs strictly after the configuration, so it cleans the gui of those widgets
@@ -176,7 +214,7 @@ class MainWidget(QWidget, LogMixin):
     def run_experiment(self):
         self.log_debug(msg="Changing interface to the data interface")
         self.error = self.sequencer.start_sequence(self.progress_manager.run_started.emit,
-                                                   self.progress_manager.point_add)
+                                                   self.progress_manager.point_add, *self.resume_from)
         self.sequence_ended.emit()
 
     def stop_experiment(self):
@@ -208,7 +246,7 @@ class MainWidget(QWidget, LogMixin):
                                                    "Comma-separated values (*.csv);;All Files (*)", options=options)
 
         if file_name:
-            self.sequencer.data.to_csv(file_name)
+            self.start_export(file_name, ".csv")
 
     def export_to_matlab(self):
         options = QFileDialog.Options()
@@ -218,7 +256,54 @@ class MainWidget(QWidget, LogMixin):
                                                    "MAT-file (*.MAT);;All Files (*)", options=options)
 
         if file_name:
-            self.sequencer.data.to_matlab(file_name)
+            self.start_export(file_name, ".mat")
+
+    def export_data(self):
+        options = QFileDialog.Options()
+        file_dialog = QFileDialog()
+        file_dialog.setDirectory(self.out_folder)
+        file_name, _ = file_dialog.getSaveFileName(self, "Save File", "",
+                                                   "Parquet (*.parquet);;Arrow IPC (*.arrow *.feather);;"
+                                                   "HDF5 (*.h5 *.hdf5);;MAT-file v7.3 (*.mat);;"
+                                                   "Comma-separated values (*.csv);;All Files (*)", options=options)
+
+        if file_name:
+            self.start_export(file_name)
+
+    def start_export(self, file_name: str, extension: str = None):
+        """
+        Exports the data in the background, in a format chosen by the extension of the file.
+
+        :param extension: the extension added to the file if it doesn't have one.
+        """
+        if self.exporter is not None:
+            return
+        if extension and not path.splitext(file_name)[1]:
+            file_name += extension
+        try:
+            self.exporter = DataExporter(self.sequencer.data, file_name)
+        except Exception as e:
+            error_box = QMessageBox()
+            error_box.setText(f"The data couldn't be exported:\n{''.join(format_exception_only(e))}")
+            error_box.exec()
+            return
+        self.data_export_progress.setValue(0)
+        self.data_export_progress.setVisible(True)
+        self.exporter.start(self.export_progress.emit, self.export_ended.emit)
+
+    @pyqtSlot(int, int)
+    def show_export_progress(self, exported: int, total: int):
+        self.data_export_progress.setMaximum(max(total, 1))
+        self.data_export_progress.setValue(exported)
+
+    @pyqtSlot(object)
+    def export_end(self, error: Exception):
+        self.exporter = None
+        self.data_export_progress.setVisible(False)
+        if error is not None:
+            error_box = QMessageBox()
+            error_box.setText(f"The data couldn't be exported:\n{''.join(format_exception_only(error))}")
+            error_box.exec()
 
     def export_docs_to_htm(self):
         options = QFileDialog.Options()
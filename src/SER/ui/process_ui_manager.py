@@ -19,6 +19,8 @@ from ..model.sequencer import ExperimentSequencer
 # Time between update ticks
 # TODO: Think about changing this to a parameter or an environment variable
 REFRESH_TIME = int(environ.get("REFRESH_TIME", 50))  # ms
+# Maximum amount of points kept between screen updates, the oldest ones are only counted if the interface falls behind
+PROGRESS_LIMIT = int(environ.get("PROGRESS_LIMIT", 10000))
 COLOR_RUN_END = "green"
 COLOR_RUN_IN_PROGRESS = "yellow"
 COLOR_RUN_STOPPED = "red"
@@ -45,8 +47,10 @@ class ProcessUIManager(QObject, LogMixin):
         self.data = sequencer.data
 
         self.progress_list = []
+        self.progress_dropped = 0  # Points removed from the progress list since the last screen update
         self.progress_lock = Lock()
         self.running = False
+        self.resume_position = 0  # Points already measured of the first run, when resuming from a checkpoint
 
         self.run_started.connect(self.run_start)
 
@@ -61,6 +65,9 @@ class ProcessUIManager(QObject, LogMixin):
     def point_add(self):
         self.progress_lock.acquire()
         self.progress_list.append(self.data.last_datum())
+        if len(self.progress_list) > PROGRESS_LIMIT:
+            del self.progress_list[:len(self.progress_list) - PROGRESS_LIMIT]
+            self.progress_dropped += 1
         self.progress_lock.release()
 
     # Start
@@ -69,8 +76,9 @@ class ProcessUIManager(QObject, LogMixin):
         # We lock the list until we reinitialize the process ui
         self.progress_lock.acquire()
         self.progress_list = []
+        self.progress_dropped = 0
 
-        self.progress_tracker.start()
+        self.progress_tracker.start(0 if self.running else self.resume_position)
         for process_ui in self.process_uis:
             process_ui.initialize()
 
@@ -92,14 +100,18 @@ class ProcessUIManager(QObject, LogMixin):
         # Assignment operations are atomic, but we want to ensure that delta list isn't modified during the update
         self.progress_lock.acquire()
         delta_list = self.progress_list
+        dropped = self.progress_dropped
         self.progress_list = []
+        self.progress_dropped = 0
         self.progress_lock.release()
+        if dropped:
+            self.log_warning(f"The interface fell behind, {dropped} points were not shown")
 
         # we filter the delta_list to only the latest run initialized
         delta_list = list(filter(lambda x: x["run"]["id"] == self.run_number, delta_list))
 
         # Now that we have thread safe data, we update the process_ui which the data since the last iteration
-        self.progress_tracker.advance(len(delta_list))
+        self.progress_tracker.advance(len(delta_list) + dropped)
         for process_ui in self.process_uis:
             try:
                 process_ui.add_data(delta_list)
@@ -109,6 +121,15 @@ class ProcessUIManager(QObject, LogMixin):
         if self.running:
             QTimer().singleShot(REFRESH_TIME, self.screen_tick)
 
+    def resume(self, run: int, position: int):
+        """
+        Prepares the manager to continue a sequence loaded from a checkpoint, marking the previous runs as ended.
+        """
+        self.run_number = run
+        self.resume_position = position
+        for index in range(run):
+            self.run_list.set_color(index, QColor(COLOR_RUN_END))
+
     def add_run(self, run: object):
         self.run_list.add_item(json.dumps(run))
 
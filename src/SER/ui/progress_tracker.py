@@ -22,22 +22,28 @@ class ProgressTracker(LogMixin):
         self.progress_label = progress_label
         self.amount = 0
         self.index = 0
+        self.skipped = 0
         self.point_amount = point_amount
 
-    def start(self):
+    def start(self, skipped: int = 0):
+        """
+        :param skipped: Amount of points of the run that were measured before, when resuming from a checkpoint.
+        """
         self.amount = self.point_amount()
-        self.index = 0
+        self.index = skipped
+        self.skipped = skipped
         self.progress_bar.setRange(0, self.amount)
-        self.progress_bar.setValue(0)
+        self.progress_bar.setValue(skipped)
         self.start_time = datetime.now()
-        self.progress_label.setText(f"0/{self.amount}")  # No Locale because it's only numeric
+        self.progress_label.setText(f"{skipped}/{self.amount}")  # No Locale because it's only numeric
 
     def advance(self, amount):
         self.index += amount
-        if self.index > 0:
+        if self.index > self.skipped:
             self.progress_bar.setValue(self.index)
             time_elapsed = datetime.now() - self.start_time
-            time_remaining = time_elapsed * ((self.amount - self.index) / self.index)
+            # The skipped points don't count for the estimation, as they weren't measured in this time
+            time_remaining = time_elapsed * ((self.amount - self.index) / (self.index - self.skipped))
             self.progress_label.setText(localizator.get("progress_label").format(
                 self.index, self.amount, time_elapsed, time_remaining))
 
@@ -0,0 +1,23 @@
+from src.SER.model.checkpoint import Checkpointer
+from src.SER.model.data_repository import DataRepository
+
+
+def test_checkpoint_round_trip(tmp_path):
+    data = DataRepository()
+    for i in range(3):
+        index = data.next()
+        data.add_datum("motor", {"pos": i}, index)
+        data.finish(index)
+    data.next()  # A point that was not finished is not saved
+
+    filename = str(tmp_path / "checkpoint.pkl")
+    checkpointer = Checkpointer(filename, interval=0)
+    assert checkpointer.due()
+    checkpointer.save({"sequence": [{}], "run": 0, "position": 3, "complete": False, "data": data.state()})
+
+    state = Checkpointer.load(filename)
+    assert state["position"] == 3
+    restored = DataRepository()
+    restored.restore(state["data"])
+    assert [restored.get_datum_index(i)["motor"]["pos"] for i in range(len(restored))] == [0, 1, 2]
+    assert restored.finished == 2
@@ -0,0 +1,35 @@
+from src.SER.model.criteria import Threshold, Convergence, Budget
+from tests.runner_test import BatchStage, BatchProbe, component, run
+
+
+def test_threshold():
+    threshold = Threshold(("sensor", "val"), above=5)
+    assert not threshold.check({"sensor": {"val": 3}})
+    assert not threshold.check({"motor": {"pos": 10}})
+    assert threshold.check({"sensor": {"val": 6}})
+
+
+def test_convergence():
+    convergence = Convergence(("sensor", "val"), epsilon=0.01, window=5)
+    convergence.start_run()
+    values = [0, 10, 20] + [5] * 200
+    fired = [convergence.check({"sensor": {"val": v}}) for v in values]
+    # The running mean is 5 + 15 / n, which changes less than 0.01 over 5 points after about 90 points
+    assert 80 < fired.index(True) < 100
+
+
+def test_budget():
+    budget = Budget(points=3, sequence=True)
+    budget.start_sequence()
+    budget.start_run()
+    assert [budget.check({}) for _ in range(2)] == [False, False]
+    budget.start_run()  # A sequence budget isn't reset between runs
+    assert budget.check({})
+
+
+def test_criterion_in_batch():
+    # The probe returns 0, 1, 2, 3 on each batch of 4 points, so the threshold is met on the third point
+    runner = run([component(BatchStage(points=10), "stage")], [component(BatchProbe(), "probe")],
+                 [Threshold(("probe", "val"), above=1.5)])
+    assert runner.criterion is not None
+    assert len(runner.data) == 3 and runner.completed == 3
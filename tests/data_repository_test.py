@@ -0,0 +1,183 @@
+from pathlib import Path
+from threading import Thread
+
+import numpy as np
+import pytest
+
+from src.SER.model.data_repository import DataRepository
+
+
+def test_columnar_repository():
+    data = DataRepository()
+    for i in range(2000):
+        index = data.next(i)
+        if i % 10 == 0:
+            data.add_datum("motor", {"pos": i}, index)
+        data.add_datum("sensor", {"val": 0.5 if i else 1, "name": "a"}, index)
+        data.finish(index)
+    data.next_run()
+    data.add_datum("sensor", {"val": 2.0}, data.next(0))
+
+    assert data.columns[("motor", "pos")].values.dtype == "int64"
+    assert data.columns[("sensor", "val")].values.dtype == "float64"
+    assert data.get_datum_index(11) == {"run": {"id": 0, "point": 11}, "sensor": {"val": 0.5, "name": "a"}}
+    assert data.run_rows(1) == slice(2000, 2001)
+
+    df = data.to_dataframe()
+    # Missing configuration values are filled with the previous one
+    assert df["motor_pos"][15] == 10 and df["motor_pos"][2000] == 1990
+    assert df["sensor_val"][0] == 1.0 and df["sensor_val"][2000] == 2.0
+
+
+def test_incremental_fill():
+    data = DataRepository()
+    for i in range(5):
+        index = data.next()
+        data.add_datum("motor", {"pos": i}, index)
+    data.add_datum("sensor", {"val": 1.0}, 2)
+    first = data.to_dataframe()
+    assert data.to_dataframe() is first
+    assert data.to_internal_repr() is data.to_internal_repr()
+
+    # A late write invalidates the cached rows from that row
+    data.add_datum("sensor", {"val": 2.0}, 3)
+    index = data.next()
+    data.add_datum("motor", {"pos": 1.5}, index)
+    df = data.to_dataframe()
+    assert df is not first
+    assert list(df["sensor_val"].fillna(-1)) == [-1, -1, 1.0, 2.0, 2.0, 2.0]
+    assert list(df["motor_pos"]) == [0, 1, 2, 3, 4, 1.5]
+    assert [row["sensor"]["val"] for row in data.to_internal_repr()][3:] == [2.0, 2.0, 2.0]
+
+
+def test_spill_to_disk(tmp_path):
+    data = DataRepository(memory_budget=200 * 1024, spill_folder=str(tmp_path))
+    for i in range(3000):
+        index = data.next(i)
+        if i % 100 == 0:
+            data.add_datum("motor", {"pos": i}, index)
+        data.add_datum("sensor", {"val": float(i), "name": f"p{i}"}, index)
+        data.finish(index)
+        if i == 1999:
+            data.next_run()
+
+    stats = data.memory_stats()
+    assert stats["spilled_points"] > 0 and stats["chunks"] > 0
+    assert stats["resident_bytes"] <= 200 * 1024
+    # The spilled points are read back through the same methods
+    assert data.get_datum_index(5) == {"run": {"id": 0, "point": 5}, "sensor": {"val": 5.0, "name": "p5"}}
+    assert data.get_datum_index(2100)["motor"] == {"pos": 2100}
+    df = data.to_dataframe()
+    assert len(df) == 3000 and list(df["sensor_val"]) == [float(i) for i in range(3000)]
+    assert df["motor_pos"][2999] == 2900 and df["motor_pos"][150] == 100
+
+    restored = DataRepository()
+    restored.restore(data.state())
+    assert restored.get_datum_index(5) == data.get_datum_index(5)
+    assert restored.to_dataframe().equals(df)
+
+
+def test_publish_record():
+    data = DataRepository()
+    data.add_datum("motor", {"pos": 0}, data.next(0))
+    data.finish(0)
+    record = data.reserve(1)
+    threads = [Thread(target=record.add_datum, args=(f"sensor{i}", {"val": i})) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The reserved point isn't visible until it's published
+    assert len(data) == 1 and len(data.to_dataframe()) == 1
+
+    index = data.publish(record)
+    assert index == 1 and data.last_datum()["sensor7"] == {"val": 7}
+    assert data.get_datum_index(1)["run"] == {"id": 0, "point": 1}
+
+
+def test_times_exported_as_datetimes():
+    data = DataRepository()
+    start = 1_700_000_000_123_456_789
+    for i in range(3):
+        record = data.reserve(i)
+        record.add_datum("timestamp", {"end_time": start + i})
+        if i == 1:
+            record.add_datum("timestamp", {"motor_start": start, "motor_end": start + 500})
+        data.publish(record)
+
+    assert data.columns[("timestamp", "end_time")].values.dtype == "int64"
+    df = data.to_dataframe()
+    assert df["timestamp_end_time"][2] == np.datetime64(start + 2, "ns")
+    # The times of an instrument are only on the points where it was called
+    assert df["timestamp_motor_end"].isna().tolist() == [True, False, True]
+
+
+def test_array_observations():
+    data = DataRepository(memory_budget=200 * 2 ** 10)
+    data.declare_array("camera", "frame", (4, 3), "float32")
+    for i in range(2000):
+        record = data.reserve(i)
+        record.add_datum("camera", {"frame": np.full((4, 3), i, dtype=np.float32)})
+        if i % 2:
+            record.add_datum("spectrometer", {"spectrum": np.arange(5.0) + i})
+        data.publish(record)
+
+    assert data.offset > 0
+    assert data.get_datum_index(10)["camera"]["frame"][0, 0] == 10
+    assert data.get_datum_index(1999)["spectrometer"]["spectrum"].shape == (5,)
+    keys, order = data.export_order()
+    rows = data.export_rows(keys, order)
+    assert rows[("camera", "frame")].shape == (2000, 4, 3) and rows[("camera", "frame")].dtype == np.float32
+    # The arrays aren't forward filled
+    assert np.isnan(rows[("spectrometer", "spectrum")][0]).all()
+    assert rows[("spectrometer", "spectrum")][1].tolist() == [1, 2, 3, 4, 5]
+
+
+def test_arrays_of_varying_shape():
+    data = DataRepository()
+    data.declare_array("camera", "frame", (2,), "float64")
+    for i in range(1, 4):
+        record = data.reserve(i)
+        record.add_datum("lockin", {"samples": np.arange(float(i))})
+        data.publish(record)
+    # The undeclared column goes back to objects once the shape changes
+    assert data.columns[("lockin", "samples")].kind == "object"
+    assert [data.get_datum_index(i)["lockin"]["samples"].tolist() for i in range(3)] == [[0], [0, 1], [0, 1, 2]]
+
+    record = data.reserve(4)
+    record.add_datum("camera", {"frame": np.zeros(3)})
+    with pytest.raises(Exception, match="doesn't match the shape"):
+        data.publish(record)
+
+
+def test_internal_repr_in_export_order():
+    data = DataRepository()
+    # A serpentine pass measures the points of the second row backwards
+    for point in [0, 1, 2, 5, 4, 3]:
+        record = data.reserve(point)
+        record.add_datum("motor", {"pos": point})
+        data.publish(record)
+    rows = data.to_internal_repr()
+    assert [row["motor"]["pos"] for row in rows] == list(range(6))
+    assert [row["run"]["point"] for row in rows] == data.to_dataframe()["run_point"].tolist()
+    assert data.to_internal_repr() is rows
+
+
+def test_array_files_removed(tmp_path):
+    data = DataRepository(memory_budget=20 * 2 ** 10, spill_folder=str(tmp_path), arrays_on_disk=True)
+    for i in range(3000):
+        record = data.reserve(i)
+        record.add_datum("camera", {"frame": np.full((8, 8), i, dtype=np.float64), "exposure": i})
+        data.publish(record)
+    assert data.offset > 1024
+    column = data.columns[("camera", "frame")]
+    # The blocks that only had spilled points are removed with their files
+    files = set(tmp_path.glob("arrays/*.dat"))
+    assert files == {Path(name) for name in column.files} and len(files) == len(column.blocks)
+    assert data.get_datum_index(2999)["camera"]["frame"][0, 0] == 2999
+
+    state = data.state()
+    data.restore(state)
+    # The files of the replaced columns are removed too
+    assert not files & set(tmp_path.glob("arrays/*.dat"))
+    assert data.get_datum_index(2999)["camera"]["frame"][0, 0] == 2999
@@ -0,0 +1,235 @@
+import os
+from time import perf_counter, sleep
+
+import pytest
+
+from src.SER.interfaces import ObservableInstrument, SettleDeadline
+from src.SER.model import transport
+from src.SER.model.dispatcher import Dispatcher, STOP_GRACE
+
+
+class Sensor(ObservableInstrument):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stopped = False
+
+    def get_config(self):
+        return {}
+
+    def set_config(self, config):
+        pass
+
+    def variable_documentation(self):
+        return {"val": "A value"}
+
+    def observe(self):
+        return {"val": 1}
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_unknown_backend():
+    sensor = Sensor()
+    sensor.execution_backend = "cluster"
+    dispatcher = Dispatcher()
+    with pytest.raises(Exception, match="Unknown execution backend"):
+        dispatcher.start({"sensor": sensor})
+    # The event loop isn't started, so nothing is left running
+    assert dispatcher.loop is None and not dispatcher.workers
+
+
+class HangingSensor(Sensor):
+    """
+    Hangs in observe until it's stopped while hang is set. stop() leaves a file behind, so the test can tell in which
+    process it was called.
+    """
+    observe_timeout = 0.3
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.hang = True
+        self.marker = None
+
+    def get_config(self):
+        return {"hang": self.hang, "marker": self.marker}
+
+    def set_config(self, config):
+        self.hang = config["hang"]
+        self.marker = config["marker"]
+
+    def observe(self):
+        while self.hang and not self.stopped:
+            sleep(0.01)
+        return {"val": 1}
+
+    def observe_batch(self, amount):
+        return [self.observe() for _ in range(amount)]
+
+    def stop(self):
+        self.stopped = True
+        if self.marker:
+            with open(self.marker, "w") as f:
+                f.write(str(os.getpid()))
+
+
+class TimingOutSensor(Sensor):
+    observe_timeout = 5.0
+
+    def observe(self):
+        raise TimeoutError("The serial read timed out")
+
+
+class ProcessSensor(HangingSensor):
+    execution_backend = "process"
+    shared_memory_size = 2 ** 20
+    observe_timeout = 1.0
+
+    def observe(self):
+        # Only stop() can end the call, and it runs on another thread of the worker process
+        while self.hang:
+            if self.stopped:
+                sleep(60)
+            sleep(0.01)
+        return {"val": 1}
+
+
+def test_thread_timeout():
+    sensor = HangingSensor()
+    dispatcher = Dispatcher()
+    dispatcher.start({"sensor": sensor})
+    try:
+        for fun, args in ((sensor.observe, ()), (sensor.observe_batch, (2,))):
+            sensor.stopped = False
+            start = perf_counter()
+            dispatcher.add_task("sensor", fun, args)
+            with pytest.raises(TimeoutError, match=fun.__name__):
+                dispatcher.execute()
+            assert perf_counter() - start < 2
+            for _ in range(100):
+                if sensor.stopped:
+                    break
+                sleep(0.01)
+            assert sensor.stopped
+
+        # The replacement worker takes the next calls
+        sensor.hang = False
+        dispatcher.add_task("sensor", sensor.observe, ())
+        assert dispatcher.execute() == [("sensor", {"val": 1})]
+    finally:
+        dispatcher.shutdown()
+
+
+def test_instrument_timeout_error():
+    sensor = TimingOutSensor()
+    dispatcher = Dispatcher()
+    dispatcher.start({"sensor": sensor})
+    try:
+        worker = dispatcher.workers["sensor"]
+        dispatcher.add_task("sensor", sensor.observe, ())
+        with pytest.raises(TimeoutError, match="serial read"):
+            dispatcher.execute()
+        # The deadline wasn't reached, so the worker is kept and the instrument isn't stopped
+        assert dispatcher.workers["sensor"] is worker and not sensor.stopped
+    finally:
+        dispatcher.shutdown()
+
+
+def test_process_timeout(tmp_path):
+    sensor = ProcessSensor()
+    sensor.marker = str(tmp_path / "stopped")
+    dispatcher = Dispatcher()
+    dispatcher.start({"sensor": sensor})
+    try:
+        # The worker process starts with its first call, which shouldn't count against the deadline
+        dispatcher.start_run()
+        process = next(iter(dispatcher.workers["sensor"]._processes.values()))
+        ring = dispatcher.rings["sensor"].name
+        dispatcher.add_task("sensor", sensor.observe, ())
+        with pytest.raises(TimeoutError):
+            dispatcher.execute()
+
+        # The replacement writes in its own ring, as the old process could still write in the old one
+        assert dispatcher.rings["sensor"].name != ring
+
+        # stop() runs in the worker process, which is still stuck, so it gets terminated
+        process.join(STOP_GRACE + 5)
+        assert not process.is_alive()
+        with open(sensor.marker) as f:
+            assert int(f.read()) == process.pid
+        assert not sensor.stopped
+        for _ in range(100):
+            if ring not in transport.rings:
+                break
+            sleep(0.01)
+        assert ring not in transport.rings
+
+        sensor.hang = False
+        dispatcher.start_run()
+        dispatcher.add_task("sensor", sensor.observe, ())
+        assert dispatcher.execute() == [("sensor", {"val": 1})]
+    finally:
+        dispatcher.shutdown()
+
+
+class Timed(Sensor):
+    """
+    Records when each call starts and ends. observe takes delay seconds and configure settles for settle seconds.
+    """
+
+    def __init__(self, delay=0.0, settle=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.settle = settle
+        self.calls = []
+
+    def configure(self):
+        self.calls.append((perf_counter(), perf_counter()))
+        return SettleDeadline({}, self.settle)
+
+    def observe(self):
+        start = perf_counter()
+        sleep(self.delay)
+        self.calls.append((start, perf_counter()))
+        return {"val": 1}
+
+
+def test_dependencies_order_calls():
+    shutter, stage, camera = Timed(delay=0.1), Timed(delay=0.1), Timed()
+    dispatcher = Dispatcher()
+    dispatcher.start({"shutter": shutter, "stage": stage, "camera": camera})
+    try:
+        dispatcher.set_dependencies({"shutter": [], "stage": ["shutter"], "camera": []})
+        assert dispatcher.depth == {"shutter": 0, "stage": 1, "camera": 0}
+        # The tasks are queued out of order on purpose
+        for name, instrument in (("camera", camera), ("stage", stage), ("shutter", shutter)):
+            dispatcher.add_task(name, instrument.observe, ())
+        dispatcher.execute()
+        # The stage waits for the shutter, while the camera runs in parallel with it
+        assert stage.calls[0][0] >= shutter.calls[0][1]
+        assert camera.calls[0][0] < shutter.calls[0][1]
+    finally:
+        dispatcher.shutdown()
+
+
+def test_dependencies_errors():
+    dispatcher = Dispatcher()
+    with pytest.raises(Exception, match="not a component"):
+        dispatcher.set_dependencies({"stage": ["shutter"]})
+    with pytest.raises(Exception, match="cycle"):
+        dispatcher.set_dependencies({"shutter": ["camera"], "stage": ["shutter"], "camera": ["stage"]})
+
+
+def test_dependencies_wait_settle():
+    stage, camera = Timed(settle=0.2), Timed()
+    dispatcher = Dispatcher()
+    dispatcher.start({"stage": stage, "camera": camera})
+    try:
+        dispatcher.set_dependencies({"stage": [], "camera": ["stage"]})
+        dispatcher.add_task("stage", stage.configure, ())
+        dispatcher.add_task("camera", camera.configure, ())
+        results = dict(dispatcher.execute())
+        # The camera is configured once the stage has settled, not when its configure returns
+        assert camera.calls[0][0] >= results["stage"].deadline
+    finally:
+        dispatcher.shutdown()
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+from src.SER.model.data_repository import DataRepository
+from src.SER.model.exporter import DataExporter
+
+
+def sample_data(tmp_path) -> DataRepository:
+    data = DataRepository(memory_budget=100 * 1024, spill_folder=str(tmp_path / "spill"))
+    for i in range(1500):
+        # The points are measured in reverse, the export follows the logical order
+        record = data.reserve(1499 - i)
+        if i % 10 == 0:
+            record.add_datum("motor", {"pos": i})
+        record.add_datum("sensor", {"val": i / 2, "name": f"p{i}"})
+        data.publish(record)
+    return data
+
+
+def test_chunked_csv(tmp_path):
+    data = sample_data(tmp_path)
+    progress = []
+    exporter = DataExporter(data, str(tmp_path / "data.csv"), chunk_size=400)
+    exporter.start(lambda exported, total: progress.append((exported, total)))
+    exporter.join()
+    assert progress == [(400, 1500), (800, 1500), (1200, 1500), (1500, 1500)]
+    df = pd.read_csv(tmp_path / "data.csv", index_col=0)
+    expected = data.to_dataframe()
+    assert list(df.columns) == list(expected.columns)
+    assert df["sensor_val"].equals(expected["sensor_val"]) and df["motor_pos"].equals(expected["motor_pos"])
+
+
+def test_columnar_formats(tmp_path):
+    pytest.importorskip("pyarrow")
+    h5py = pytest.importorskip("h5py")
+    data = sample_data(tmp_path)
+    expected = data.to_dataframe()
+    DataExporter(data, str(tmp_path / "data.parquet"), chunk_size=400).run()
+    assert pd.read_parquet(tmp_path / "data.parquet").equals(expected)
+
+    DataExporter(data, str(tmp_path / "data.mat"), chunk_size=400).run()
+    with open(tmp_path / "data.mat", "rb") as file:
+        assert file.read(10) == b"MATLAB 7.3"
+    with h5py.File(tmp_path / "data.mat") as file:
+        assert file["sensor_val"].shape == (1, 1500)
+        assert (file["sensor_val"][0] == expected["sensor_val"].to_numpy()).all()
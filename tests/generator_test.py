@@ -2,7 +2,10 @@ from typing import List, Any, Generator
 from time import sleep
 from datetime import datetime
 
+from src.SER.interfaces import points
+from src.SER.interfaces.adaptive import Refinement1D, Refinement2D
 from src.SER.model.gen import MetaArgTracker
+from src.SER.model.plan import ScanPlan, PointSource
 
 
 """
@@ -76,3 +79,125 @@ def test_mixed_coupled():
     tracker.advance()
     assert current_elements == [1, 3, 'B']
 
+
+
+def test_plan_random_access():
+    plan = ScanPlan([
+        [PointSource(lambda: util_gen([0, 1], 0, None))],
+        [PointSource(lambda: util_gen(['A', 'B', 'C'], 1, None))],
+    ])
+
+    assert len(plan) == 6
+    assert plan[0] == (0, 0)
+    assert plan[4] == (1, 1)
+    assert plan[-1] == (1, 2)
+    assert plan.index((1, 1)) == 4
+    assert plan[2:5].tolist() == [[0, 2], [1, 0], [1, 1]]
+    assert plan.args(1, 2) == [('C', 1, None)]
+
+
+def test_plan_amount_without_generating():
+    generated = []
+
+    def gen():
+        for x in range(1000):
+            generated.append(x)
+            yield x,
+
+    plan = ScanPlan([[PointSource(gen, lambda: 1000)], [PointSource(gen, lambda: 1000)]])
+    assert len(plan) == 1000000
+    assert generated == []
+    plan.args(1, 3)
+    assert generated == [0, 1, 2, 3]
+
+
+def test_seek():
+    current_elements = [None, None]
+
+    tracker = MetaArgTracker([
+        (0, lambda: util_gen([0, 1], 0, current_elements), add_elements),
+        (1, lambda: util_gen([2, 3], 1, current_elements), add_elements),
+    ])
+
+    tracker.seek(2)
+    assert tracker.advance()
+    assert current_elements == [1, 2]
+    assert tracker.advance()
+    assert current_elements == [1, 3]
+    assert not tracker.advance()
+
+
+def test_plan_table_from_arrays():
+    current_elements = [None, None]
+    x = points.linspace(0, 1, 3)
+    yz = points.grid(points.point_list([5, 6], ("y",)), points.logspace(1, 100, 3, "z"))
+    tracker = MetaArgTracker([
+        (0, PointSource(plan=x, name="X"), lambda pos: add_elements(pos, 0, current_elements)),
+        (1, PointSource(plan=yz, name="YZ"), lambda y, z: add_elements((y, z), 1, current_elements)),
+    ])
+    assert tracker.points_amount() == 18
+
+    table = tracker.plan.table()
+    assert table.dtype.names == ("X_pos", "YZ_y", "YZ_z")
+    assert list(table[4]) == [0.0, 6.0, 10.0]
+
+    tracker.seek(4)
+    tracker.advance()
+    assert current_elements == [0.0, (6.0, 10.0)]
+    assert tracker.plan.split(4) == [(0, 4), (4, 9), (9, 13), (13, 18)]
+
+
+def test_serpentine_and_nearest():
+    calls = []
+    tracker = MetaArgTracker([
+        (0, PointSource(plan=points.linspace(0, 1, 2)), lambda pos: calls.append(("outer", pos))),
+        (1, PointSource(plan=points.linspace(0, 2, 3), traversal="serpentine"), lambda pos: calls.append(pos)),
+    ])
+    assert [tuple(x) for x in tracker.plan[:]] == [(0, 0), (0, 1), (0, 2), (1, 2), (1, 1), (1, 0)]
+    assert [tuple(x) for x in tracker.plan[::2]] == [(0, 0), (0, 2), (1, 1)]
+    assert [tuple(x) for x in tracker.plan[-2:]] == [(1, 1), (1, 0)]
+    while tracker.advance():
+        pass
+    # The inner level is configured again at the start of each pass, even on the same point
+    assert calls == [("outer", 0.0), 0.0, 1.0, 2.0, ("outer", 1.0), 2.0, 1.0, 0.0]
+
+    tracker.seek(3)
+    tracker.advance()
+    assert tracker.logical_index() == 5
+
+    plan = ScanPlan([[PointSource(plan=points.point_list([0, 10, 1, 9, 2]), traversal="nearest")]])
+    assert list(plan.table()["pos"]) == [0, 1, 2, 9, 10]
+
+
+def test_progressive():
+    plan = ScanPlan([
+        [PointSource(plan=points.linspace(0, 4, 5), traversal="progressive")],
+        [PointSource(plan=points.linspace(0, 4, 5), traversal="progressive")],
+    ])
+    order = [tuple(x) for x in plan[:]]
+    # Every point is measured once, starting with the coarsest grid
+    assert sorted(order) == [(x, y) for x in range(5) for y in range(5)]
+    assert order[:4] == [(0, 0), (0, 4), (4, 0), (4, 4)]
+    assert set(order[4:9]) == {(0, 2), (2, 0), (2, 2), (2, 4), (4, 2)}
+
+
+def test_adaptive_refinement():
+    measured = []
+    tracker = MetaArgTracker([
+        (0, lambda: util_gen([0, 1], 0, [None]), lambda *args: None),
+        (1, Refinement1D(("sensor", "val"), 0, 10, initial=5, budget=20), lambda x: measured.append(x)),
+    ])
+    assert tracker.points_amount() == 40
+    while tracker.advance():
+        # A narrow peak at 6
+        tracker.record({"sensor": {"val": float(abs(measured[-1] - 6) < 0.5)}})
+    assert len(measured) == 40
+    first_pass = sorted(measured[:20])
+    assert sum(1 for x in first_pass if 5 <= x <= 7) > sum(1 for x in first_pass if x <= 2)
+
+    plan = Refinement2D(("sensor", "val"), (0, 1), (0, 1), initial=(3, 3), budget=15)
+    visited = []
+    while (point := plan.next_point()) is not None:
+        visited.append(point)
+        plan.record({"sensor": {"val": point[0] * point[1]}})
+    assert len(visited) == 15 and len(set(visited)) == 15
@@ -0,0 +1,182 @@
+from time import perf_counter, sleep
+
+import numpy as np
+import pytest
+
+from src.SER.interfaces import ConfigurableInstrument, ObservableInstrument, ComponentInitialization, Component, \
+    SettleDeadline
+from src.SER.model.criteria import Budget
+from src.SER.model.data_repository import DataRepository
+from src.SER.model.runner import ExperimentRunner, split_batch
+from tests.stream_test import Counter
+
+
+class Stage(ConfigurableInstrument):
+    def __init__(self, points=10, **kwargs):
+        super().__init__(**kwargs)
+        self.points = points
+        self.configured = []
+
+    def get_config(self):
+        return {"coupling": self.coupling}
+
+    def variable_documentation(self):
+        return {"x": "Position"}
+
+    def get_points(self):
+        for x in range(self.points):
+            yield (x,)
+
+    def point_amount(self):
+        return self.points
+
+    def configure(self, x):
+        self.configured.append(x)
+        return {"x": x}
+
+
+class SettlingStage(Stage):
+    execution_backend = "process"
+    shared_memory_size = 0
+
+    def configure(self, x):
+        settle = SettleDeadline({"x": x}, 0.05)
+        settle.datum["deadline"] = settle.deadline
+        return settle
+
+
+class BatchStage(Stage):
+    batch_size = 4
+    settle = 0.0  # Settle time of each batch
+
+    def configure_batch(self, points):
+        self.configured.extend(x for x, in points)
+        return SettleDeadline([{"x": x} for x, in points], self.settle)
+
+
+class Probe(ObservableInstrument):
+    def get_config(self):
+        return {}
+
+    def set_config(self, config):
+        pass
+
+    def variable_documentation(self):
+        return {"val": "A value"}
+
+    def observe(self):
+        return {"val": 1}
+
+
+class SlowProbe(Probe):
+    def observe(self):
+        sleep(0.01)
+        return {"val": 1}
+
+
+class TimingProbe(Probe):
+    execution_backend = "process"
+    shared_memory_size = 0
+
+    def observe(self):
+        return {"time": perf_counter()}
+
+
+class BatchProbe(Probe):
+    batch_size = 8
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.observed = []  # The perf_counter time of each call
+
+    def observe_batch(self, amount):
+        self.observed.append(perf_counter())
+        return {"val": np.arange(amount)}
+
+
+def component(instrument, name, **kwargs) -> ComponentInitialization:
+    comp = Component()
+    comp.instrument = instrument
+    return ComponentInitialization(comp, getattr(instrument, "coupling", 0), 0, 0, name=name, **kwargs)
+
+
+def run(configurable, observable, criteria=()) -> ExperimentRunner:
+    """
+    Runs a single run of the components, as the sequencer does.
+    """
+    runner = ExperimentRunner(configurable, observable, DataRepository(), criteria)
+    runner.dispatcher.start({comp.name: comp.component.instrument for comp in [*configurable, *observable]})
+    try:
+        runner.setup_arg_tracker()
+        runner.run_experiment()
+    finally:
+        runner.dispatcher.shutdown()
+    assert runner.error is None
+    return runner
+
+
+def test_stop_discards_pipelined_point():
+    stage = Stage()
+    # The probe is insensitive to the stage, so each point is configured while the previous one is observed
+    runner = run([component(stage, "stage")], [component(Probe(), "probe", insensitive_to=["stage"])],
+                 [Budget(points=3)])
+    assert len(runner.data) == 3
+    assert runner.completed == 3 and runner.points_run == 3
+    # The fourth point was configured ahead, but it's not part of the data
+    assert stage.configured == [0, 1, 2, 3]
+    assert [runner.data.get_datum_index(i)["stage"]["x"] for i in range(3)] == [0, 1, 2]
+
+
+def test_split_batch():
+    assert split_batch("probe", {"val": np.arange(3)}, 3) == [{"val": 0}, {"val": 1}, {"val": 2}]
+    assert split_batch("probe", ({"val": 0}, {"val": 1}), 2) == [{"val": 0}, {"val": 1}]
+    with pytest.raises(Exception, match="returned 2 points for a batch of 3"):
+        split_batch("probe", [{"val": 0}, {"val": 1}], 3)
+
+
+def test_batches():
+    stage, probe = BatchStage(points=10), BatchProbe()
+    stage.settle = 0.1
+    start = perf_counter()
+    runner = run([component(stage, "stage")], [component(probe, "probe")])
+
+    # The chunks are as large as the smallest batch_size, and the last one has the rest of the points
+    assert stage.configured == list(range(10))
+    assert len(probe.observed) == 3
+    # Each chunk is observed once the stage settled
+    assert probe.observed[0] - start >= stage.settle
+    assert all(b - a >= stage.settle for a, b in zip(probe.observed, probe.observed[1:]))
+
+    data = [runner.data.get_datum_index(i) for i in range(len(runner.data))]
+    assert [datum["stage"]["x"] for datum in data] == list(range(10))
+    assert [datum["probe"]["val"] for datum in data] == [0, 1, 2, 3, 0, 1, 2, 3, 0, 1]
+    # The points of a chunk share the times of the chunk
+    assert data[0]["timestamp"] == data[3]["timestamp"] != data[4]["timestamp"]
+    assert runner.completed == 10
+
+
+def test_pipelined_stream_slices():
+    stage = Stage(points=20)
+    runner = run([component(stage, "stage")], [component(SlowProbe(), "probe", insensitive_to=["stage"]),
+                                                component(Counter(), "counter", insensitive_to=["stage"])])
+    slices = [runner.data.get_datum_index(i)["counter"]["samples"][:, 0] for i in range(20)]
+    # Each point configured ahead starts where the previous one ended, so no sample is given to two points
+    samples = np.concatenate(slices)
+    assert np.all(np.diff(samples) > 0)
+    assert all(len(part) > 0 for part in slices[1:])
+
+
+def test_process_settle():
+    runner = run([component(SettlingStage(points=5), "stage")], [component(TimingProbe(), "probe")])
+    data = [runner.data.get_datum_index(i) for i in range(5)]
+    # perf_counter is shared by the processes, so the deadline of one is valid in the other
+    assert all(datum["probe"]["time"] >= datum["stage"]["deadline"] for datum in data)
+
+
+def test_instrument_times_inside_point():
+    runner = run([component(Stage(), "stage")], [component(Probe(), "probe")])
+    for i in range(len(runner.data)):
+        times = runner.data.get_datum_index(i)["timestamp"]
+        # The call of each instrument sits inside the phase of its point
+        assert times["config_start_time"] <= times["stage_start"] <= times["stage_end"] <= \
+            times["observe_start_time"] <= times["probe_start"] <= times["probe_end"] <= times["end_time"]
@@ -0,0 +1,41 @@
+from src.SER.model.checkpoint import Checkpointer
+from src.SER.model.sequencer import ExperimentSequencer
+from tests.runner_test import Stage, Probe, component
+
+
+def sequencer(filename: str, interval: float = 60.0) -> ExperimentSequencer:
+    result = ExperimentSequencer([component(Stage(), "stage")], [component(Probe(), "probe")],
+                                 Checkpointer(filename, interval))
+    result.load_sequence([{"stage": {"coupling": 0}, "probe": {}}] * 2)
+    return result
+
+
+def test_resume_from_checkpoint(tmp_path):
+    filename = str(tmp_path / "checkpoint.pkl")
+    first = sequencer(filename, interval=0)
+
+    def stop_in_second_run():
+        if first.run_index == 1 and first.runner.completed == 3:
+            first.stop()
+    assert first.start_sequence(None, stop_in_second_run) is None
+    assert len(first.data) == 13
+    state = Checkpointer.load(filename)
+    assert (state["run"], state["position"], state["complete"]) == (1, 3, False)
+
+    second = sequencer(filename)
+    assert second.resume_sequence(filename, None, None) is None
+    # Only the missing points of the second run are measured
+    assert second.components["stage"].configured == list(range(3, 10))
+    data = second.data.to_dataframe()
+    assert data["run_id"].tolist() == [0] * 10 + [1] * 10
+    assert data["run_point"].tolist() == list(range(10)) * 2
+    assert Checkpointer.load(filename)["complete"]
+
+
+def test_failed_start_shuts_down(tmp_path):
+    failing = sequencer(str(tmp_path / "checkpoint.pkl"))
+    failing.runner.seek = None  # Calling it fails, like seeking in an adaptive plan
+    error = failing.start_sequence(None, None, start_run=0, start_position=2)
+    assert isinstance(error, TypeError)
+    # The dispatcher was shut down, so no worker or loop is left behind
+    assert failing.stopped and failing.runner.dispatcher.loop is None and not failing.runner.dispatcher.workers
@@ -0,0 +1,91 @@
+from time import sleep
+
+import numpy as np
+
+from src.SER.interfaces import StreamingInstrument
+from src.SER.model.stream import RingBuffer, StreamCapture
+
+
+class Counter(StreamingInstrument):
+    """
+    Streams consecutive integers in blocks of 10 samples, one block per millisecond.
+    """
+    stream_capacity = 10000
+    stream_rate = 10000.0
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.next = 0
+        self.streaming = False
+        self.polled = False
+
+    def get_config(self):
+        return {}
+
+    def set_config(self, config):
+        pass
+
+    def variable_documentation(self):
+        return {"samples": "Consecutive integers"}
+
+    def start_stream(self):
+        self.streaming = True
+
+    def stop_stream(self):
+        self.streaming = False
+
+    def read_stream(self):
+        sleep(0.001)
+        if self.next % 50 == 0 and not self.polled:
+            # A poll without data in between
+            self.polled = True
+            return np.zeros(0)
+        self.polled = False
+        block = np.arange(self.next, self.next + 10, dtype=np.float64)
+        self.next += 10
+        return block
+
+
+def test_ring_buffer_wraps():
+    buffer = RingBuffer(8, channels=2)
+    assert buffer.oldest() == float("inf")
+    for i in range(3):
+        # Blocks of 3 samples, timed at 1 Hz so sample k is taken at time k
+        buffer.write(np.arange(6 * i, 6 * i + 6).reshape(3, 2), end_time=3 * i + 2, rate=1.0)
+    assert buffer.written == 9
+    # The first sample was overwritten
+    assert buffer.oldest() == 1
+    assert buffer.between(-1, 100)[:, 0].tolist() == [2, 4, 6, 8, 10, 12, 14, 16]
+
+    # The intervals are open at the start, so consecutive intervals don't share samples
+    assert buffer.between(2, 5)[:, 0].tolist() == [6, 8, 10]
+    assert buffer.between(5, 8)[:, 0].tolist() == [12, 14, 16]
+    assert buffer.between(20, 30).shape == (0, 2)
+
+    # Without a rate every sample of the block gets the time of the block
+    buffer.write(np.array([1.0, 2.0]), end_time=10)
+    assert buffer.between(9, 10)[:, 0].tolist() == [1, 2]
+
+    # An empty block doesn't change the buffer
+    buffer.write(np.zeros(0), end_time=11, rate=1.0)
+    buffer.write(np.zeros((0, 2)), end_time=11)
+    assert buffer.written == 11
+
+
+def test_stream_capture():
+    counter = Counter()
+    capture = StreamCapture("counter", counter)
+    capture.start()
+    try:
+        assert counter.streaming
+        for _ in range(5000):
+            if capture.buffer.written >= 200 or capture.error is not None:
+                break
+            sleep(0.001)
+    finally:
+        capture.stop()
+    assert not counter.streaming and not capture.thread.is_alive()
+    # The empty blocks of the polls without data didn't stop the capture
+    assert capture.error is None
+    samples = capture.slice(0, float("inf"))[:, 0]
+    assert samples.tolist() == list(range(len(samples)))
@@ -0,0 +1,32 @@
+import numpy as np
+
+from src.SER.model.data_repository import DataRepository
+from src.SER.model.transport import SharedRing, SharedArray, share
+
+
+def test_ring_handles_resolved_by_repository():
+    ring = SharedRing.create(4 * 2 ** 20)
+    try:
+        data = DataRepository()
+        for i in range(20):
+            # Each frame is 1 MiB, so the ring wraps around several times
+            result = share({"frame": np.full((512, 256), i, dtype=np.float64), "val": i}, ring)
+            assert isinstance(result["frame"], SharedArray) and result["val"] == i
+            record = data.reserve(i)
+            record.add_datum("camera", result)
+            data.publish(record)
+        assert data.get_datum_index(19)["camera"]["frame"][0, 0] == 19
+        assert data.get_datum_index(3)["camera"]["frame"][-1, -1] == 3
+
+        # The arrays that aren't released fill the ring, and the next ones are left to be pickled
+        handles = [share({"frame": np.zeros((512, 256))}, ring)["frame"] for _ in range(5)]
+        assert all(isinstance(handle, SharedArray) for handle in handles[:4])
+        assert isinstance(handles[4], np.ndarray)
+
+        # The rows of a batch are handles of the stacked array
+        ring.release(handles[3].end)
+        batch = share({"frame": np.arange(3 * 64 * 128, dtype=np.float64).reshape(3, 64, 128)}, ring, batch=True)
+        row = batch["frame"][2]
+        assert row.shape == (64, 128) and row.array()[0, 0] == 2 * 64 * 128
+    finally:
+        ring.close()
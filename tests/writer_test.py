@@ -0,0 +1,38 @@
+from time import time_ns
+
+from src.SER.model.writer import DataWriter, read_data
+
+
+def write_points(filename):
+    writer = DataWriter(filename, interval=0.01)
+    writer.start()
+    for i in range(20):
+        datum = {"run": {"id": 0, "point": i}, "sensor": {"val": i / 2}, "timestamp": {"end_time": time_ns()}}
+        if i % 5 == 0:
+            datum["motor"] = {"pos": i}
+        writer.write(datum)
+    writer.stop()
+
+
+def test_json_lines_survive_a_cut(tmp_path):
+    filename = str(tmp_path / "data.jsonl")
+    write_points(filename)
+    # A crash in the middle of a write leaves an incomplete line
+    with open(filename, "a") as file:
+        file.write('{"run": {"id": 0, "poi')
+    df = read_data(filename)
+    assert len(df) == 20 and df["sensor_val"][19] == 9.5 and df["motor_pos"][10] == 10
+    assert df["timestamp_end_time"].dtype.kind == "M"
+
+    # A resumed sequence appends after the cut line without losing its first point
+    write_points(filename)
+    df = read_data(filename)
+    assert len(df) == 40 and df["sensor_val"][20] == 0
+
+
+def test_arrow_parts(tmp_path):
+    filename = str(tmp_path / "data.arrows")
+    write_points(filename)
+    write_points(filename)  # A second sequence continues in a new part
+    df = read_data(filename)
+    assert len(df) == 40 and list(df["run_point"][18:22]) == [18, 19, 0, 1]